@@ -3,6 +3,10 @@
 
     ** By Cro-Ki l@b, 2017 **
 '''
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import chain
 from math import sqrt, inf
 
 class BoundingRect(tuple):
@@ -54,11 +58,40 @@ class BoundingRect(tuple):
     def height(self):
         return self.ymax - self.ymin + 1
 
+    def columns(self, first, last):
+        """ the range of the x values from 'first' to 'last' (included) which are in the rectangle """
+        return range(max(first, self.xmin), min(last, self.xmax) + 1)
+
+    def rows(self, first, last):
+        """ the range of the y values from 'first' to 'last' (included) which are in the rectangle """
+        return range(max(first, self.ymin), min(last, self.ymax) + 1)
+
+    def clip(self, cells):
+        """ return the list of the cells which are in the rectangle """
+        xmin, ymin, xmax, ymax = self
+        return [cell for cell in cells if xmin <= cell[0] <= xmax and ymin <= cell[1] <= ymax]
+
+    def clip_line(self, cells):
+        """ return the cells of a line, from the first one in the rectangle
+        to the last one before the line leaves it """
+        xmin, ymin, xmax, ymax = self
+        result = []
+        for cell in cells:
+            if xmin <= cell[0] <= xmax and ymin <= cell[1] <= ymax:
+                result.append(cell)
+            elif result:
+                break
+        return result
+
 class BaseGeometry:
     """ Base class for geometry classes
     ! Should be overriden """
     ANGLES = (1, 2, 3)
 
+    # shapes which only depend on the relative position of their parameters
+    # to their origin, and on its parity (see ShapeCache)
+    _invariant_shapes = frozenset(("line", "zone", "ring", "triangle", "rectangle", "hollow_rectangle"))
+
     def __repr__(self):
         return "<{} object>".format(self.__class__.__name__)
 
@@ -97,6 +130,56 @@ class BaseGeometry:
         """ return the bounding rectangle of the from (x, y) coordinates """
         return BoundingRect.from_(*args)
 
+    # shapes as arrays
+    # the '_array' methods return the cells of the shapes in a flat array('i')
+    # of interleaved x and y values [x0, y0, x1, y1, ...], in the same order than the lists.
+    # numpy can use it without copy: numpy.frombuffer(result, dtype=numpy.intc).reshape(-1, 2)
+    @staticmethod
+    def _cells_array(cells):
+        """ return the flat array of the (x, y) cells """
+        return array('i', chain.from_iterable(cells))
+
+    @staticmethod
+    def _spans_cells(spans):
+        """ return the list of the cells of the spans, which are either columns (x, range of y values)
+        or rows (range of x values, y) """
+        result = []
+        for x, y in spans:
+            if isinstance(x, range):
+                result.extend((cx, y) for cx in x)
+            else:
+                result.extend((x, cy) for cy in y)
+        return result
+
+    @staticmethod
+    def _spans_array(spans):
+        """ return the flat array of the cells of the spans (see _spans_cells):
+        the x and y values are built span by span, then interleaved
+        the ranges shared by several spans (e.g. the columns of a rectangle) are converted once """
+        xs, ys = array('i'), array('i')
+        converted = {}
+        for x, y in spans:
+            if isinstance(x, range):
+                if not x in converted:
+                    converted[x] = array('i', x)
+                xs.extend(converted[x])
+                ys.extend(array('i', (y,)) * len(x))
+            else:
+                if not y in converted:
+                    converted[y] = array('i', y)
+                xs.extend(array('i', (x,)) * len(y))
+                ys.extend(converted[y])
+        return BaseGeometry._interleave(xs, ys)
+
+    @staticmethod
+    def _interleave(xs, ys):
+        """ return the flat array of the x, y values from the array of the x values
+        and the array of the y values """
+        result = array('i', (0,)) * (2 * len(xs))
+        result[0::2] = xs
+        result[1::2] = ys
+        return result
+
     @staticmethod
     def graphicsitem(x, y, scale=120):
         """ returns the list of the points which compose the (x, y) cell """
@@ -108,10 +191,70 @@ class BaseGeometry:
         """ returns a list of the neighbors of (x, y) """
         raise NotImplementedError("this method is abstract and should be reimplemented in subclasses")
 
+    @classmethod
+    def neighbors_offsets(cls, parity=0):
+        """ returns the list of the (dx, dy) offsets from a cell to its neighbors,
+        for a cell on an even (parity=0) or an odd (parity=1) column """
+        return [(x - parity, y) for x, y in cls.neighbors(parity, 0)]
+
+    @staticmethod
+    def _parity(x):
+        """ the parity of the x column, the shapes having the same offsets
+        from the origins of a same parity """
+        return 0
+
     @classmethod
     def line(cls, x1, y1, x2, y2, br=BoundingRect()):
         raise NotImplementedError("this method is abstract and should be reimplemented in subclasses")
 
+    @classmethod
+    def _line(cls, x1, y1, x2, y2, br):
+        """ the 'line' method, without the check of the arguments """
+        raise NotImplementedError("this method is abstract and should be reimplemented in subclasses")
+
+    @classmethod
+    def _line_values(cls, x1, y1, x2, y2, br):
+        """ return the x values and the y values of the cells of '_line' """
+        cells = cls._line(x1, y1, x2, y2, br)
+        return [x for x, _ in cells], [y for _, y in cells]
+
+    @classmethod
+    def lines(cls, origins, targets, br=BoundingRect()):
+        """ returns the lines from each (x, y) origin to the (x, y) target of the same index,
+        or from a single (x, y) origin to each of the targets, in a (cells, offsets) CSR layout:
+        'cells' is the flat array of the x, y values of all the lines, and the ith line
+        is made of the cells offsets[i] (included) to offsets[i + 1] (excluded), i.e.
+            cells[2 * offsets[i]:2 * offsets[i + 1]]
+        the arguments are checked once for all the lines """
+        if len(origins) == 2 and all(isinstance(value, int) for value in origins):
+            origins = [tuple(origins)] * len(targets)
+        if len(origins) != len(targets):
+            raise ValueError("expected as many origins as targets (given: {} and {})".format(len(origins), len(targets)))
+        cls.assertCoordinates(*origins, *targets)
+
+        xs, ys, offsets = cls._lines_values(zip(origins, targets), br)
+        return cls._interleave(array('i', xs), array('i', ys)), array('q', offsets)
+
+    @classmethod
+    def _lines_values(cls, segments, br):
+        """ return the x values, the y values and the offsets (see 'lines') of the cells
+        of the lines for each ((x1, y1), (x2, y2)) segment, without the check of the arguments """
+        line_values = cls._line_values
+        xs, ys, offsets = [], [], [0]
+        for (x1, y1), (x2, y2) in segments:
+            line_xs, line_ys = line_values(x1, y1, x2, y2, br)
+            xs.extend(line_xs)
+            ys.extend(line_ys)
+            offsets.append(len(xs))
+        return xs, ys, offsets
+
+    @classmethod
+    def line_array(cls, x1, y1, x2, y2, br=BoundingRect()):
+        """ returns the cells of 'line' as a flat array of x, y values """
+        cls.assertCoordinates((x1, y1), (x2, y2))
+        xs, ys = cls._line_values(x1, y1, x2, y2, br)
+        return cls._interleave(array('i', xs), array('i', ys))
+
     @classmethod
     def line3d(cls, x1, y1, z1, x2, y2, z2, br=BoundingRect()):
         """ returns a line from (x1 ,y1, z1) to (x2, y2, z2)
@@ -119,10 +262,10 @@ class BaseGeometry:
         cls.assertCoordinates((z1, z2))
         hoLine = cls.line(x1, y1, x2, y2)
         if z1 == z2:
-            return [(x, y, z1) for x, y in hoLine]
+            return br.clip_line([(x, y, z1) for x, y in hoLine])
         else:
             ligneZ = SquareGeometry.line(0, z1, (len(hoLine) - 1), z2)
-            return [(hoLine[d][0], hoLine[d][1], z) for d, z in ligneZ]
+            return br.clip_line([(hoLine[d][0], hoLine[d][1], z) for d, z in ligneZ])
 
     @classmethod
     def zone(cls, x, y, radius, br=BoundingRect()):
@@ -137,14 +280,109 @@ class BaseGeometry:
             current = buffer
             for x, y in current:
                 buffer |= frozenset(cls.neighbors(x, y))
-        return list(buffer)
+        return br.clip(buffer)
+
+    @classmethod
+    def zone_array(cls, x, y, radius, br=BoundingRect()):
+        """ returns the cells of 'zone' as a flat array of x, y values """
+        return cls._cells_array(cls.zone(x, y, radius, br))
+
+    @classmethod
+    def ring(cls, x, y, radius, br=BoundingRect()):
+        """ returns the list of the coordinates of the cells at exactly 'radius' moves from (x, y)
+        """
+        inner = frozenset(cls.zone(x, y, radius - 1, br)) if radius > 0 else frozenset()
+        return [cell for cell in cls.zone(x, y, radius, br) if not cell in inner]
 
     @classmethod
     def triangle(cls, xa, ya, xh, yh, iAngle, br=BoundingRect()):
         """ return the list of the (x, y) coordinates in a triangle
         with (xa, ya) apex and (xh, yh) middle of the base """
+        cls.assertCoordinates((xa, ya), (xh, yh))
+        cls._assertValidAngle(iAngle)
+        sides = cls._triangle_sides(xa, ya, xh, yh, iAngle)
+
+        if (xa, ya) == (xh, yh):
+            return br.clip([(xa, ya)])
+        spans, hat = cls._triangle_spans(sides, br)
+        return cls._spans_cells(spans) + hat
+
+    @classmethod
+    def triangle_array(cls, xa, ya, xh, yh, iAngle, br=BoundingRect()):
+        """ returns the cells of 'triangle' as a flat array of x, y values """
+        cls.assertCoordinates((xa, ya), (xh, yh))
+        cls._assertValidAngle(iAngle)
+        sides = cls._triangle_sides(xa, ya, xh, yh, iAngle)
+
+        if (xa, ya) == (xh, yh):
+            return cls._cells_array(br.clip([(xa, ya)]))
+        spans, hat = cls._triangle_spans(sides, br)
+        result = cls._spans_array(spans)
+        result.extend(cls._cells_array(hat))
+        return result
+
+    @classmethod
+    def _triangle_sides(cls, xa, ya, xh, yh, iAngle):
+        """ return the three (x1, y1, x2, y2) sides of the triangle
+        with (xa, ya) apex and (xh, yh) middle of the base """
         raise NotImplementedError("this method is abstract and should be reimplemented in subclasses")
 
+    @classmethod
+    def _triangle_spans(cls, segments, br=BoundingRect()):
+        """ return the cells of the triangle from its three (x1, y1, x2, y2) sides,
+        as a list of columns spans and a list of cells:
+        the spans go from each cell of the side with the lowest slope (the base) up to
+        the cells of the two other sides (the 'hat'), the cells are the ones of the hat.
+        The hat cells of each column are sorted once, so that the end of each
+        column is found by a binary search. Only the cells in 'br' are returned """
+        # base (lower slope)
+        x1, y1, x2, y2 = min(segments, key=lambda x: (abs ((x[3] - x[1]) / (x[2] - x[0])) if x[2] != x[0] else 10 ** 10))
+        base = cls.line(x1, y1, x2, y2)
+        y_base = y1
+        segments = list(segments)
+        segments.remove((x1, y1, x2, y2))
+
+        # 'hat' (the 2 other sides)
+        hat = []
+        for x1, y1, x2, y2 in segments:
+            hat.extend(cls.line(x1, y1, x2, y2))
+        y_top = segments[0][3]
+
+        # sense (1 if top is under base, -1 if not)
+        sense = 1 if y_top > y_base else -1
+
+        # the top may be on the same row as the base: the sense is then
+        # the one where the hat can be reached from every cell of the base
+        spans = cls._fill_columns(base, hat, sense, br)
+        if spans is None:
+            spans = cls._fill_columns(base, hat, -sense, br)
+        return spans, br.clip(hat)
+
+    @staticmethod
+    def _fill_columns(base, hat, sense, br):
+        """ return the (x, range of y values) spans from each cell of the base (included)
+        to the hat (excluded), moving along the y axis in the given sense,
+        None if the hat can not be reached. The spans are clipped to 'br' """
+        # y values of the hat on each column, sorted in the sense of the filling
+        columns = {}
+        for x, y in hat:
+            columns.setdefault(x, set()).add(sense * y)
+        columns = {x: sorted(values) for x, values in columns.items()}
+
+        result = []
+        for x, y in base:
+            values = columns.get(x, ())
+            i = bisect_left(values, sense * y)
+            if i == len(values):
+                return None
+            if not br.xmin <= x <= br.xmax:
+                continue
+            if sense > 0:
+                result.append((x, br.rows(y, values[i] - 1)))
+            else:
+                result.append((x, br.rows(-values[i] + 1, y)[::-1]))
+        return result
+
     @classmethod
     def triangle3d(self, xa, ya, za, xh, yh, zh, iAngle, br=BoundingRect()):
         """Returns a list of (x, y, z) coordinates in a 3d-cone
@@ -163,18 +401,43 @@ class BaseGeometry:
     def rectangle(cls, x1, y1, x2, y2, br=BoundingRect()):
         """return a list of cells in a rectangle between (X1, Y1), (X2, Y2)"""
         xmin, ymin, xmax, ymax = cls._bounding_rect((x1, y1), (x2, y2))
-        return [(x, y) for x in range(xmin, xmax + 1) for y in range(ymin, ymax + 1)]
+        return [(x, y) for x in br.columns(xmin, xmax) for y in br.rows(ymin, ymax)]
+
+    @classmethod
+    def rectangle_array(cls, x1, y1, x2, y2, br=BoundingRect()):
+        """ returns the cells of 'rectangle' as a flat array of x, y values """
+        xmin, ymin, xmax, ymax = cls._bounding_rect((x1, y1), (x2, y2))
+        rows = br.rows(ymin, ymax)
+        return cls._spans_array([(x, rows) for x in br.columns(xmin, xmax)])
 
     @classmethod
     def hollow_rectangle(cls, x1, y1, x2, y2, br=BoundingRect()):
         """return a list of cells composing the sides of the rectangle between (X1, Y1), (X2, Y2)"""
+        return cls._spans_cells(cls._hollow_rectangle_spans(x1, y1, x2, y2, br))
+
+    @classmethod
+    def hollow_rectangle_array(cls, x1, y1, x2, y2, br=BoundingRect()):
+        """ returns the cells of 'hollow_rectangle' as a flat array of x, y values """
+        return cls._spans_array(cls._hollow_rectangle_spans(x1, y1, x2, y2, br))
+
+    @classmethod
+    def _hollow_rectangle_spans(cls, x1, y1, x2, y2, br):
+        """ return the sides of the rectangle as a list of spans (see _spans_cells) """
         xmin, ymin, xmax, ymax = cls._bounding_rect((x1, y1), (x2, y2))
+        columns, rows = br.columns(xmin, xmax), br.rows(ymin, ymax)
         if (xmin, ymin) == (xmax, ymax):
-            return [(xmin, ymin)]
-        return [(x, ymin) for x in range(xmin, xmax)] + \
-               [(xmax, y) for y in range(ymin, ymax)] + \
-               [(x, ymax) for x in range(xmax, xmin, -1)] + \
-               [(xmin, y) for y in range(ymax, ymin, -1)]
+            return [(xmin, rows)] if xmin in columns else []
+        # each side is clipped, the sides out of the rectangle being dropped
+        spans = []
+        if ymin in rows:
+            spans.append((br.columns(xmin, xmax - 1), ymin))
+        if xmax in columns:
+            spans.append((xmax, br.rows(ymin, ymax - 1)))
+        if ymax in rows:
+            spans.append((br.columns(xmin + 1, xmax)[::-1], ymax))
+        if xmin in columns:
+            spans.append((xmin, br.rows(ymin + 1, ymax)[::-1]))
+        return spans
 
     @classmethod
     def rotate(cls, center, coordinates, rotations, br=BoundingRect()):
@@ -182,6 +445,11 @@ class BaseGeometry:
         after a rotation of 'rotations' times around the (x, y) center """
         raise NotImplementedError("this method is abstract and should be reimplemented in subclasses")
 
+    @classmethod
+    def rotate_array(cls, center, coordinates, rotations, br=BoundingRect()):
+        """ returns the cells of 'rotate' as a flat array of x, y values """
+        return cls._cells_array(cls.rotate(center, coordinates, rotations, br))
+
     @staticmethod
     def square_distance(x1, y1, x2, y2):
         """ distance between 1 and 2 (run faster than a standard distance) """
@@ -192,6 +460,11 @@ class BaseGeometry:
         """returns the manhattan distance between the two cells"""
         raise NotImplementedError("this method is abstract and should be reimplemented in subclasses")
 
+    @classmethod
+    def distance(cls, xa, ya, xb, yb):
+        """returns the minimal number of moves from a cell to the other"""
+        raise NotImplementedError("this method is abstract and should be reimplemented in subclasses")
+
 class SquareGeometry(BaseGeometry):
     """ Geometry on square grids """
     _nodiags = False
@@ -218,25 +491,31 @@ class SquareGeometry(BaseGeometry):
         cls.assertCoordinates((x, y))
 
         if cls._nodiags:
-            return [(x, y - 1), \
-                    (x - 1, y), (x + 1, y)  , \
-                    (x, y + 1)]
+            return br.clip([(x, y - 1), \
+                            (x - 1, y), (x + 1, y)  , \
+                            (x, y + 1)])
         else:
-            return [(x - 1, y - 1), (x, y - 1), (x + 1, y - 1), \
-                    (x - 1, y), (x + 1, y)  , \
-                    (x - 1, y + 1), (x, y + 1), (x + 1, y + 1)]
+            return br.clip([(x - 1, y - 1), (x, y - 1), (x + 1, y - 1), \
+                            (x - 1, y), (x + 1, y)  , \
+                            (x - 1, y + 1), (x, y + 1), (x + 1, y + 1)])
 
     @classmethod
     def line(cls, x1, y1, x2, y2, br=BoundingRect()):
         """ reimplemented from BaseGeometry.line
         Implementation of bresenham's algorithm
+        the line stops at the border of 'br': the cells of a line are contiguous
+        in the rectangle, so that the generation stops once it leaves it
         """
         # check the arguments
         cls.assertCoordinates((x1, y1), (x2, y2))
+        return cls._line(x1, y1, x2, y2, br)
 
+    @classmethod
+    def _line(cls, x1, y1, x2, y2, br):
+        """ reimplemented from BaseGeometry._line """
         # special case
         if (x1, y1) == (x2, y2):
-            return [(x1, y1)]
+            return br.clip([(x1, y1)])
 
         # diagonal symmetry
         vertically_oriented = (abs(y2 - y1) > abs(x2 - x1))
@@ -255,13 +534,15 @@ class SquareGeometry(BaseGeometry):
         offset = 0.0
         step = 1 if dy > 0 else -1
 
+        xmin, ymin, xmax, ymax = br
         result = []
         y = y1
         for x in range(x1, x2 + 1):
-            if vertically_oriented:
-                result.append((y, x))
-            else:
-                result.append((x, y))
+            cell = (y, x) if vertically_oriented else (x, y)
+            if xmin <= cell[0] <= xmax and ymin <= cell[1] <= ymax:
+                result.append(cell)
+            elif result:
+                break
 
             offset += alpha
             if offset > 0.5:
@@ -273,16 +554,103 @@ class SquareGeometry(BaseGeometry):
         return result
 
     @classmethod
-    def triangle(cls, xa, ya, xh, yh, iAngle, br=BoundingRect()):
-        """ reimplemented from BaseGeometry.triangle """
-        cls.assertCoordinates((xa, ya), (xh, yh))
-        cls._assertValidAngle(iAngle)
+    def _line_values(cls, x1, y1, x2, y2, br):
+        """ reimplemented from BaseGeometry._line_values
+        the cells of a line are in the rectangle of its ends: when both are in 'br',
+        the values of the long axis are a range and the ones of the short axis are
+        computed without clipping """
+        xmin, ymin, xmax, ymax = br
+        if (x1, y1) == (x2, y2) or not (xmin <= x1 <= xmax and xmin <= x2 <= xmax and \
+                                        ymin <= y1 <= ymax and ymin <= y2 <= ymax):
+            return super(SquareGeometry, cls)._line_values(x1, y1, x2, y2, br)
+
+        # diagonal and horizontal symmetries, as in _line
+        vertically_oriented = (abs(y2 - y1) > abs(x2 - x1))
+        if vertically_oriented:
+            y1, x1, y2, x2 = x1, y1, x2, y2
+        reversed_sym = (x1 > x2)
+        if reversed_sym:
+            x2, y2, x1, y1 = x1, y1, x2, y2
 
-        if (xa, ya) == (xh, yh):
-            return [(xa, ya)]
+        dx, dy = x2 - x1, y2 - y1
+        alpha = (abs(dy) / dx)
+        offset = 0.0
+        step = 1 if dy > 0 else -1
 
-        result = []
+        values = array('i')
+        append = values.append
+        y = y1
+        for _ in range(dx + 1):
+            append(y)
+            offset += alpha
+            if offset > 0.5:
+                y += step
+                offset -= 1.0
+        axis = array('i', range(x1, x2 + 1))
+
+        if reversed_sym:
+            axis.reverse()
+            values.reverse()
+        return (values, axis) if vertically_oriented else (axis, values)
+
+    @classmethod
+    def _lines_values(cls, segments, br):
+        """ reimplemented from BaseGeometry._lines_values
+        the stepping of '_line_values' is inlined, and the values of all the lines
+        are appended to the same lists """
+        xmin, ymin, xmax, ymax = br
+        line_values = super(SquareGeometry, cls)._line_values
+        xs, ys, offsets = [], [], [0]
+        for (x1, y1), (x2, y2) in segments:
+            if (x1, y1) == (x2, y2) or not (xmin <= x1 <= xmax and xmin <= x2 <= xmax and \
+                                            ymin <= y1 <= ymax and ymin <= y2 <= ymax):
+                line_xs, line_ys = line_values(x1, y1, x2, y2, br)
+                xs.extend(line_xs)
+                ys.extend(line_ys)
+                offsets.append(len(xs))
+                continue
+
+            # diagonal and horizontal symmetries, as in _line
+            vertically_oriented = (abs(y2 - y1) > abs(x2 - x1))
+            if vertically_oriented:
+                y1, x1, y2, x2 = x1, y1, x2, y2
+            reversed_sym = (x1 > x2)
+            if reversed_sym:
+                x2, y2, x1, y1 = x1, y1, x2, y2
+
+            dx, dy = x2 - x1, y2 - y1
+            if dy == 0:
+                values = [y1] * (dx + 1)
+            else:
+                alpha = (abs(dy) / dx)
+                offset = 0.0
+                step = 1 if dy > 0 else -1
+                values = []
+                y = y1
+                for _ in range(dx + 1):
+                    values.append(y)
+                    offset += alpha
+                    if offset > 0.5:
+                        y += step
+                        offset -= 1.0
+
+            if reversed_sym:
+                axis = range(x2, x1 - 1, -1)
+                values.reverse()
+            else:
+                axis = range(x1, x2 + 1)
+            if vertically_oriented:
+                xs.extend(values)
+                ys.extend(axis)
+            else:
+                xs.extend(axis)
+                ys.extend(values)
+            offsets.append(len(xs))
+        return xs, ys, offsets
 
+    @classmethod
+    def _triangle_sides(cls, xa, ya, xh, yh, iAngle):
+        """ reimplemented from BaseGeometry._triangle_sides """
         # direction vector
         dx_dir, dy_dir = xh - xa, yh - ya
 
@@ -298,39 +666,13 @@ class SquareGeometry(BaseGeometry):
         xc, yc = round(xc), round(yc)
 
         # sides:
-        lines = [(xa, ya, xb, yb), (xb, yb, xc, yc), (xc, yc, xa, ya)]
-
-        # base (lower slope)
-        x1, y1, x2, y2 = min(lines, key=lambda x: (abs ((x[3] - x[1]) / (x[2] - x[0])) if x[2] != x[0] else 10 ** 10))
-        base = cls.line(x1, y1, x2, y2)
-        y_base = y1
-        lines.remove((x1, y1, x2, y2))
-
-        # 'hat' (2 other sides)
-        hat = []
-        y_top = None
-        for x1, y1, x2, y2 in lines:
-            if y_top == None:
-                y_top = y2
-            hat.extend(cls.line(x1, y1, x2, y2))
-
-        # sense (1 if top is under base, -1 if not)
-        sense = 1 if y_top > y_base else -1
-
-        # rove over y values from base to hat
-        for x, y in base:
-            while not (x, y) in hat:
-                result.append((x, y))
-                y += sense
-        result.extend(hat)
-
-        return result
+        return [(xa, ya, xb, yb), (xb, yb, xc, yc), (xc, yc, xa, ya)]
 
     @classmethod
     def triangle3d(cls, xa, ya, za, xh, yh, zh, iAngle, br=BoundingRect()):
         """ reimplemented from BaseGeometry.triangle3d """
         cls.assertCoordinates((za, zh))
-        flat_triangle = cls.triangle(xa, ya, xh, yh, iAngle)
+        flat_triangle = cls.triangle(xa, ya, xh, yh, iAngle, br)
 
         result = {}
         k = 1 / (iAngle * sqrt(3))
@@ -363,7 +705,7 @@ class SquareGeometry(BaseGeometry):
         cls.assertCoordinates(center, *coordinates)
 
         if coordinates == [center] or rotations % 4 == 0:
-            return coordinates
+            return br.clip(coordinates)
         x0, y0 = center
         result = []
         for x, y in coordinates:
@@ -372,17 +714,81 @@ class SquareGeometry(BaseGeometry):
                 dx, dy = dy, -dx
             xr, yr = dx + x0, dy + y0
             result.append((xr, yr))
-        return result
+        return br.clip(result)
 
     @staticmethod
     def manhattan(xa, ya, xb, yb):
         """ reimplemented from BaseGeometry.manhattan """
         return abs(xa - xb) + abs(ya - yb)
 
+    @classmethod
+    def distance(cls, xa, ya, xb, yb):
+        """ reimplemented from BaseGeometry.distance """
+        if cls._nodiags:
+            return abs(xa - xb) + abs(ya - yb)
+        return max(abs(xa - xb), abs(ya - yb))
+
+    @classmethod
+    def zone(cls, x, y, radius, br=BoundingRect()):
+        """ reimplemented from BaseGeometry.zone
+        the zone is a square, or a diamond if the diagonal moves are not allowed,
+        each column being clipped to 'br' """
+        return cls._spans_cells(cls._zone_spans(x, y, radius, br))
+
+    @classmethod
+    def zone_array(cls, x, y, radius, br=BoundingRect()):
+        """ reimplemented from BaseGeometry.zone_array """
+        return cls._spans_array(cls._zone_spans(x, y, radius, br))
+
+    @classmethod
+    def _zone_spans(cls, x, y, radius, br):
+        """ return the columns of the zone as (x, range of y values) spans """
+        cls.assertCoordinates((x, y))
+        cls._assertPositiveInt(radius)
+
+        if not cls._nodiags:
+            rows = br.rows(y - radius, y + radius)
+            return [(cx, rows) for cx in br.columns(x - radius, x + radius)]
+        return [(cx, br.rows(y - radius + abs(cx - x), y + radius - abs(cx - x))) \
+                for cx in br.columns(x - radius, x + radius)]
+
+    @classmethod
+    def ring(cls, x, y, radius, br=BoundingRect()):
+        """ reimplemented from BaseGeometry.ring """
+        cls.assertCoordinates((x, y))
+        cls._assertPositiveInt(radius)
+        if radius == 0:
+            return br.clip([(x, y)])
+
+        columns, rows = br.columns(x - radius, x + radius), br.rows(y - radius, y + radius)
+        if not cls._nodiags:
+            # top and bottom sides, then left and right sides
+            result = [(cx, cy) for cy in (y - radius, y + radius) if cy in rows for cx in columns]
+            result.extend((cx, cy) for cx in (x - radius, x + radius) if cx in columns \
+                                   for cy in br.rows(y - radius + 1, y + radius - 1))
+            return result
+        result = []
+        for cx in columns:
+            height = radius - abs(cx - x)
+            if y - height in rows:
+                result.append((cx, y - height))
+            if height and y + height in rows:
+                result.append((cx, y + height))
+        return result
+
 class HexGeometry(BaseGeometry):
     """ Base class for hexagonal grids classes
     This class should be overridden """
 
+    # the vertices of the triangles are rounded in cubic coordinates,
+    # where the halves are rounded to the nearest even value
+    _invariant_shapes = BaseGeometry._invariant_shapes - {"triangle"}
+
+    @staticmethod
+    def _parity(x):
+        """ reimplemented from BaseGeometry._parity """
+        return x & 1
+
     @staticmethod
     def from_cubic(xu, yu, zu):
         """convert cubic coordinates (xu, yu, zu) in standards coordinates (x, y) [offset]"""
@@ -421,6 +827,64 @@ class HexGeometry(BaseGeometry):
             xa, ya, xb, yb = args
             return HexGeometry.manhattan(*HexGeometry.to_cubic(xa, ya), *HexGeometry.to_cubic(xb, yb))
 
+    @classmethod
+    def distance(cls, xa, ya, xb, yb):
+        """ reimplemented from BaseGeometry.distance,
+        using cubic coordinates"""
+        xua, yua, zua = cls.to_cubic(xa, ya)
+        xub, yub, zub = cls.to_cubic(xb, yb)
+        return max(abs(xua - xub), abs(yua - yub), abs(zua - zub))
+
+    @classmethod
+    def _columns(cls, x, y, radius):
+        """ yield the (column, first row, last row) of the cells at 'radius' moves
+        or less from (x, y): in cubic coordinates, the cells of each column of the zone
+        have a contiguous range of xu values """
+        xu = y - (x >> 1)
+        for dz in range(-radius, radius + 1):
+            column = x + dz
+            shift = xu + (column >> 1)
+            yield column, shift + max(-radius, -radius - dz), shift + min(radius, radius - dz)
+
+    @classmethod
+    def zone(cls, x, y, radius, br=BoundingRect()):
+        """ reimplemented from BaseGeometry.zone,
+        using cubic coordinates, each column being clipped to 'br' """
+        return cls._spans_cells(cls._zone_spans(x, y, radius, br))
+
+    @classmethod
+    def zone_array(cls, x, y, radius, br=BoundingRect()):
+        """ reimplemented from BaseGeometry.zone_array """
+        return cls._spans_array(cls._zone_spans(x, y, radius, br))
+
+    @classmethod
+    def _zone_spans(cls, x, y, radius, br):
+        """ return the columns of the zone as (x, range of y values) spans """
+        cls.assertCoordinates((x, y))
+        cls._assertPositiveInt(radius)
+        columns = br.columns(x - radius, x + radius)
+        return [(column, br.rows(first, last)) for column, first, last in cls._columns(x, y, radius) \
+                if column in columns]
+
+    @classmethod
+    def ring(cls, x, y, radius, br=BoundingRect()):
+        """ reimplemented from BaseGeometry.ring,
+        using cubic coordinates """
+        cls.assertCoordinates((x, y))
+        cls._assertPositiveInt(radius)
+        columns = br.columns(x - radius, x + radius)
+        result = []
+        for column, first, last in cls._columns(x, y, radius):
+            if not column in columns:
+                continue
+            rows = br.rows(first, last)
+            if abs(column - x) == radius:
+                # first and last columns are entirely on the ring
+                result.extend((column, cy) for cy in rows)
+            else:
+                result.extend((column, cy) for cy in (first, last) if cy in rows)
+        return result
+
 class FHexGeometry(HexGeometry):
     """ Flat-hexagonal grid object """
 
@@ -441,18 +905,59 @@ class FHexGeometry(HexGeometry):
     @classmethod
     def neighbors(cls, x, y, br=BoundingRect()):
         if x % 2 == 0:
-            return [(x, y - 1), (x + 1, y - 1), (x + 1, y), (x, y + 1), (x - 1, y), (x - 1, y - 1)]
+            return br.clip([(x, y - 1), (x + 1, y - 1), (x + 1, y), (x, y + 1), (x - 1, y), (x - 1, y - 1)])
         else:
-            return [(x, y - 1), (x + 1, y), (x + 1, y + 1), (x, y + 1), (x - 1, y + 1), (x - 1, y)]
+            return br.clip([(x, y - 1), (x + 1, y), (x + 1, y + 1), (x, y + 1), (x - 1, y + 1), (x - 1, y)])
 
     @classmethod
     def line(cls, x1, y1, x2, y2, br=BoundingRect()):
         """ reimplemented from BaseGeometry.line
-        Implementation of bresenham's algorithm """
+        Implementation of bresenham's algorithm
+        the line stops at the border of 'br' """
         cls.assertCoordinates((x1, y1), (x2, y2))
+        return cls._line(x1, y1, x2, y2, br)
+
+    @classmethod
+    def _line(cls, x1, y1, x2, y2, br):
+        """ reimplemented from BaseGeometry._line """
+        xs, ys = cls._line_steps(x1, y1, x2, y2)
+        return br.clip_line(list(zip(xs, ys)))
+
+    @classmethod
+    def _line_values(cls, x1, y1, x2, y2, br):
+        """ reimplemented from BaseGeometry._line_values
+        the line can leave the rows of its ends, so that the y values are checked against 'br' """
+        xs, ys = cls._line_steps(x1, y1, x2, y2)
+        if xs and br.xmin <= min(x1, x2) and max(x1, x2) <= br.xmax and \
+                  br.ymin <= min(ys) and max(ys) <= br.ymax:
+            return xs, ys
+        cells = br.clip_line(list(zip(xs, ys)))
+        return [x for x, _ in cells], [y for _, y in cells]
+
+    @classmethod
+    def _lines_values(cls, segments, br):
+        """ reimplemented from BaseGeometry._lines_values
+        the values of all the lines are appended to the same lists """
+        xmin, ymin, xmax, ymax = br
+        line_steps = cls._line_steps
+        xs, ys, offsets = [], [], [0]
+        for (x1, y1), (x2, y2) in segments:
+            line_xs, line_ys = line_steps(x1, y1, x2, y2)
+            if not (line_xs and xmin <= min(x1, x2) and max(x1, x2) <= xmax and \
+                    ymin <= min(line_ys) and max(line_ys) <= ymax):
+                cells = br.clip_line(list(zip(line_xs, line_ys)))
+                line_xs, line_ys = [x for x, _ in cells], [y for _, y in cells]
+            xs.extend(line_xs)
+            ys.extend(line_ys)
+            offsets.append(len(xs))
+        return xs, ys, offsets
 
+    @staticmethod
+    def _line_steps(x1, y1, x2, y2):
+        """ return the list of the x values and the list of the y values of the cells
+        of the line from (x1, y1) to (x2, y2), two empty lists in case of error """
         if (x1, y1) == (x2, y2):
-            return [(x1, y1)]
+            return [x1], [y1]
 
         # vertical symmetry
         reversed_sym = (x1 > x2)
@@ -463,6 +968,9 @@ class FHexGeometry(HexGeometry):
         # The unit that will be used is half the width of an hexagon: u = 0.5773
         # In that system, half-height of an hexagon is 0.8860u, or sqrt(3)/2 * u
 
+        xs, ys = [x1], [y1]
+        x, y = x1, y1
+
         if abs(x2 - x1) < (2 * abs((y2 - y1)) + abs(x2 % 2) - abs(x1 % 1)):
             # vertical quadrants
 
@@ -480,31 +988,24 @@ class FHexGeometry(HexGeometry):
             k = dx / (dy * sqrt(3))
             pas = sqrt(3) / 2
 
-            result = []
             offset = 0.0
-            pos = (x1, y1)
-            result.append(pos)
-
-            while pos != (x2, y2):
+            while x != x2 or y != y2:
                 offset += (k * pas)
                 if offset <= 0.5:
-                    x, y = pos
-                    pos = x, y + direction
-                    result.append(pos)
+                    y += direction
                     offset += (k * pas)
                 else:
-                    x, y = pos
                     if (x % 2 == 0 and direction == 1) or (x % 2 == 1 and direction == -1):
-                        pos = x + 1, y
+                        x += 1
                     else:
-                        pos = x + 1, y + direction
-                    result.append(pos)
+                        x, y = x + 1, y + direction
                     offset -= 1.5
+                xs.append(x)
+                ys.append(y)
 
                 # in case of error in the algorithm, we should avoid infinite loop:
-                if direction * pos[1] > direction * y2:
-                    result = []
-                    break
+                if direction * y > direction * y2:
+                    return [], []
 
         else:
             # horizontal quadrants
@@ -517,50 +1018,33 @@ class FHexGeometry(HexGeometry):
             k = dy / dx
             pas = 1
 
-            result = []
             d = 0.0
-            pos = (x1, y1)
-            result.append(pos)
-
-            while pos != (x2, y2):
+            while x != x2 or y != y2:
                 d += k * pas
                 if d > 0:
-                    x, y = pos
-                    if x % 2 == 0:
-                        pos = x + 1, y
-                    else:
-                        pos = x + 1, y + 1
-                    result.append(pos)
+                    if x % 2 != 0:
+                        y += 1
                     d -= 0.5
                 else:
-                    x, y = pos
                     if x % 2 == 0:
-                        pos = x + 1, y - 1
-                    else:
-                        pos = x + 1, y
-                    result.append(pos)
+                        y -= 1
                     d += 0.5
+                x += 1
+                xs.append(x)
+                ys.append(y)
 
                 # in case of error in the algorithm, we should avoid infinite loop:
-                if pos[0] > x2:
-                    result = []
-                    break
+                if x > x2:
+                    return [], []
 
         if reversed_sym:
-            result.reverse()
-        return result
+            xs.reverse()
+            ys.reverse()
+        return xs, ys
 
     @classmethod
-    def triangle(cls, xa, ya, xh, yh, iAngle, br=BoundingRect()):
-        """ reimplemented from BaseGeometry.triangle """
-        cls.assertCoordinates((xa, ya), (xh, yh))
-        cls._assertValidAngle(iAngle)
-
-        if (xa, ya) == (xh, yh):
-            return [(xa, ya)]
-
-        result = []
-
+    def _triangle_sides(cls, xa, ya, xh, yh, iAngle):
+        """ reimplemented from BaseGeometry._triangle_sides """
         # convert to cubic coodinates (see 'cube_coords' lib)
         xua, yua, _ = cls.to_cubic(xa, ya)
         xuh, yuh, zuh = cls.to_cubic(xh, yh)
@@ -584,39 +1068,13 @@ class FHexGeometry(HexGeometry):
         xc, yc = cls.from_cubic(xuc, yuc, zuc)
 
         # sides
-        segments = [(xa, ya, xb, yb), (xb, yb, xc, yc), (xc, yc, xa, ya)]
-
-        # base (lower slope)
-        x1, y1, x2, y2 = min(segments, key=lambda x: (abs ((x[3] - x[1]) / (x[2] - x[0])) if x[2] != x[0] else 10 ** 10))
-        base = cls.line(x1, y1, x2, y2)
-        y_base = y1
-        segments.remove((x1, y1, x2, y2))
-
-        # 'hat' (the 2 other sides)
-        chapeau = []
-        y_sommet = None
-        for x1, y1, x2, y2 in segments:
-            if y_sommet == None:
-                y_sommet = y2
-            chapeau.extend(cls.line(x1, y1, x2, y2))
-
-        # sense (1 if top is under base, -1 if not)
-        sens = 1 if y_sommet > y_base else -1
-
-        # rove over y values from base to hat
-        for x, y in base:
-            while not (x, y) in chapeau:
-                result.append((x, y))
-                y += sens
-        result.extend(chapeau)
-
-        return result
+        return [(xa, ya, xb, yb), (xb, yb, xc, yc), (xc, yc, xa, ya)]
 
     @classmethod
     def triangle3d(cls, xa, ya, za, xh, yh, zh, iAngle, br=BoundingRect()):
         """ reimplemented from BaseGeometry.triangle3d """
         cls.assertCoordinates((za, zh))
-        flat_triangle = cls.triangle(xa, ya, xh, yh, iAngle)
+        flat_triangle = cls.triangle(xa, ya, xh, yh, iAngle, br)
 
         result = {}
 
@@ -654,7 +1112,7 @@ class FHexGeometry(HexGeometry):
         cls.assertCoordinates(center, *coordinates)
 
         if coordinates == [center] or rotations % 6 == 0:
-            return coordinates
+            return br.clip(coordinates)
         x0, y0 = center
         xu0, yu0, zu0 = cls.to_cubic(x0, y0)
         result = []
@@ -667,4 +1125,118 @@ class FHexGeometry(HexGeometry):
             xru, yru, zru = dxu + xu0, dyu + yu0, dzu + zu0
             xr, yr = cls.from_cubic(xru, yru, zru)
             result.append((xr, yr))
-        return result
+        return br.clip(result)
+
+
+class ShapeCache():
+    """ LRU cache of shapes, stored as templates of (dx, dy) offsets from their origin
+
+    The shapes computed from (x, y) only depend on the position of their other
+    parameters relative to (x, y), and on the parity of x on hexagonal grids: a template
+    is computed once by (geometry, shape, relative parameters, parity), and then translated
+    to the requested origin. The least recently used templates are evicted once they hold
+    more than 'max_cells' cells. The cells are returned in the same order than the ones
+    of the geometry methods.
+
+        cache = ShapeCache()
+        cache.zone(SquareGeometry, 10, 10, 3)
+    """
+    def __init__(self, max_cells=100000):
+        if not isinstance(max_cells, int) or max_cells < 1:
+            raise ValueError("max_cells has to be a strictly positive integer (given: {})".format(max_cells))
+        self.max_cells = max_cells
+        self._templates = OrderedDict()
+        self._cells = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._templates)
+
+    @property
+    def cells(self):
+        """ the number of cells stored in the templates """
+        return self._cells
+
+    @property
+    def stats(self):
+        """ dictionary of the hits, misses and evictions counts, and of the number of templates and cells """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "templates": len(self), "cells": self._cells}
+
+    def clear(self):
+        """ remove all the templates (the statistics are kept) """
+        self._templates.clear()
+        self._cells = 0
+
+    def shape(self, geometry, name, x, y, *args, br=BoundingRect()):
+        """ return geometry.<name>(x, y, *args, br), where args are the parameters
+        which follow the origin, the points being given as x, y pairs of values
+        the templates are not clipped: the shapes are clipped to 'br' once translated
+        the shapes which are not translation invariant are computed directly """
+        compute = getattr(geometry, name)
+        if not name in geometry._invariant_shapes:
+            return compute(x, y, *args, br=br)
+        geometry.assertCoordinates((x, y))
+
+        parity = geometry._parity(x)
+        key = (geometry, name, parity, getattr(geometry, "_nodiags", None)) + self._relative(name, x, y, args)
+        try:
+            template = self._templates[key]
+        except KeyError:
+            template = tuple((cx - parity, cy) for cx, cy in compute(parity, 0, *self._absolute(name, parity, args, x, y)))
+            self.misses += 1
+            if len(template) <= self.max_cells:
+                self._templates[key] = template
+                self._cells += len(template)
+                while self._cells > self.max_cells:
+                    _, evicted = self._templates.popitem(last=False)
+                    self._cells -= len(evicted)
+                    self.evictions += 1
+        else:
+            self.hits += 1
+            self._templates.move_to_end(key)
+        cells = [(x + dx, y + dy) for dx, dy in template]
+        return br.clip_line(cells) if name == "line" else br.clip(cells)
+
+    @staticmethod
+    def _relative(name, x, y, args):
+        """ the parameters of the shape, the points being relative to (x, y) """
+        if name in ("zone", "ring"):
+            return tuple(args)
+        if name == "triangle":
+            xh, yh, iAngle = args
+            return (xh - x, yh - y, iAngle)
+        x2, y2 = args
+        return (x2 - x, y2 - y)
+
+    @staticmethod
+    def _absolute(name, parity, args, x, y):
+        """ the parameters of the shape with its origin moved to (parity, 0) """
+        if name in ("zone", "ring"):
+            return args
+        dx, dy = parity - x, -y
+        if name == "triangle":
+            xh, yh, iAngle = args
+            return (xh + dx, yh + dy, iAngle)
+        x2, y2 = args
+        return (x2 + dx, y2 + dy)
+
+    def line(self, geometry, x1, y1, x2, y2, br=BoundingRect()):
+        return self.shape(geometry, "line", x1, y1, x2, y2, br=br)
+
+    def zone(self, geometry, x, y, radius, br=BoundingRect()):
+        return self.shape(geometry, "zone", x, y, radius, br=br)
+
+    def ring(self, geometry, x, y, radius, br=BoundingRect()):
+        return self.shape(geometry, "ring", x, y, radius, br=br)
+
+    def triangle(self, geometry, xa, ya, xh, yh, iAngle, br=BoundingRect()):
+        return self.shape(geometry, "triangle", xa, ya, xh, yh, iAngle, br=br)
+
+    def rectangle(self, geometry, x1, y1, x2, y2, br=BoundingRect()):
+        return self.shape(geometry, "rectangle", x1, y1, x2, y2, br=br)
+
+    def hollow_rectangle(self, geometry, x1, y1, x2, y2, br=BoundingRect()):
+        return self.shape(geometry, "hollow_rectangle", x1, y1, x2, y2, br=br)
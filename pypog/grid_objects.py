@@ -3,9 +3,15 @@
 
     ** By Cro-Ki l@b, 2017 **
 '''
+from array import array
+from collections import Counter
+from math import inf
+from weakref import WeakSet
+
 from pypog.geometry_objects import BaseGeometry, FHexGeometry, SquareGeometry, \
-    BoundingRect, HexGeometry
-from pypog.pathfinding import Pathfinder
+    BoundingRect, HexGeometry, ShapeCache
+from pypog.pathfinding import Pathfinder, ConnectivityIndex, CooperativePathfinder, \
+    PathCache
 
 
 class BaseGrid(object):
@@ -16,13 +22,33 @@ class BaseGrid(object):
     def __init__(self, width, height):
         """ instanciate a new BaseGrid object """
         self._width = 0
-        self.width = width
         self._height = 0
+        self._costs = array('d')
+        # the layer is empty: the counts are known
+        self._cost_counts = Counter()
+        self._min_cost = None
+        self._observers = WeakSet()
+        self._engines = {}
+        self._version = 0
+        self._path_cache = None
+        self._shape_cache = None
+        self.width = width
         self.height = height
 
     def __repr__(self):
         return "<{} object>".format(self.__class__.__name__)
 
+    def __getstate__(self):
+        """ the observers and the pathfinding engines attached to the grid are not pickled """
+        state = self.__dict__.copy()
+        del state["_observers"], state["_engines"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._observers = WeakSet()
+        self._engines = {}
+
     @staticmethod
     def from_geometry(geometry, *args):
         if geometry == SquareGeometry:
@@ -44,7 +70,7 @@ class BaseGrid(object):
         the new width has to be a strictly positive integer"""
         if not isinstance(width, int) or not width > 0:
             raise ValueError("'width' has to be a strictly positive integer")
-        self._width = width
+        self._resize(width, self._height)
 
     @property
     def height(self):
@@ -57,7 +83,44 @@ class BaseGrid(object):
         the new height has to be a strictly positive integer"""
         if not isinstance(height, int) or not height > 0:
             raise ValueError("'width' has to be a strictly positive integer")
-        self._height = height
+        self._resize(self._width, height)
+
+    def _resize(self, width, height):
+        """ update the dimensions of the grid, and resize the cost layer accordingly
+        (the costs of the cells which remain in the grid are kept) """
+        costs = array('d', [1.0]) * (width * height)
+        length = min(width, self._width)
+        for y in range(min(height, self._height)):
+            costs[y * width:y * width + length] = self._costs[y * self._width:y * self._width + length]
+        self._costs = costs
+        counts = self._cost_counts
+        if counts is not None and set(counts) <= {1.0} and sum(counts.values()) == self._width * self._height:
+            # all the cells had the default cost, and so have the new ones
+            self._cost_counts = Counter({1.0: width * height}) if width * height else Counter()
+            self._min_cost = None
+        else:
+            self._cost_counts = None
+        self._width, self._height = width, height
+        self.cost_changed()
+
+    @property
+    def costs(self):
+        """ the cost layer of the grid: an array('d') of the costs to move to each cell,
+        indexed like the grid (y * width + x). Default cost is 1.
+        A negative or infinite cost means the cell is impassable.
+        Use 'set_cost' to update a single cell """
+        return self._costs
+
+    @costs.setter
+    def costs(self, costs):
+        """ replace the cost layer with the 'costs' sequence of numbers,
+        which has to contain one value per cell """
+        costs = array('d', costs)
+        if len(costs) != len(self):
+            raise ValueError("expected {} costs (given: {})".format(len(self), len(costs)))
+        self._costs = costs
+        self._cost_counts = None
+        self.cost_changed()
 
     @property
     def br(self):
@@ -98,39 +161,283 @@ class BaseGrid(object):
         return self.geometry.neighbors(*args, br=self.br)
 
     def line(self, *args):
+        if self._shape_cache is not None:
+            return self._shape_cache.shape(self.geometry, "line", *args, br=self.br)
         return self.geometry.line(*args, br=self.br)
 
     def line3d(self, *args):
         return self.geometry.line3d(*args, br=self.br)
 
     def zone(self, *args):
+        if self._shape_cache is not None:
+            return self._shape_cache.shape(self.geometry, "zone", *args, br=self.br)
         return self.geometry.zone(*args, br=self.br)
 
+    def ring(self, *args):
+        if self._shape_cache is not None:
+            return self._shape_cache.shape(self.geometry, "ring", *args, br=self.br)
+        return self.geometry.ring(*args, br=self.br)
+
     def triangle(self, *args):
+        if self._shape_cache is not None:
+            return self._shape_cache.shape(self.geometry, "triangle", *args, br=self.br)
         return self.geometry.triangle(*args, br=self.br)
 
     def triangle3d(self, *args):
         return self.geometry.triangle3d(*args, br=self.br)
 
     def rectangle(self, *args):
+        if self._shape_cache is not None:
+            return self._shape_cache.shape(self.geometry, "rectangle", *args, br=self.br)
         return self.geometry.rectangle(*args, br=self.br)
 
     def hollow_rectangle(self, *args):
+        if self._shape_cache is not None:
+            return self._shape_cache.shape(self.geometry, "hollow_rectangle", *args, br=self.br)
         return self.geometry.hollow_rectangle(*args, br=self.br)
 
     def rotate(self, *args):
         return self.geometry.rotate(*args, br=self.br)
 
+    # shapes as flat arrays of x, y values (see BaseGeometry._cells_array)
+    def line_array(self, *args):
+        return self.geometry.line_array(*args, br=self.br)
+
+    def lines(self, origins, targets):
+        return self.geometry.lines(origins, targets, br=self.br)
+
+    def zone_array(self, *args):
+        return self.geometry.zone_array(*args, br=self.br)
+
+    def triangle_array(self, *args):
+        return self.geometry.triangle_array(*args, br=self.br)
+
+    def rectangle_array(self, *args):
+        return self.geometry.rectangle_array(*args, br=self.br)
+
+    def hollow_rectangle_array(self, *args):
+        return self.geometry.hollow_rectangle_array(*args, br=self.br)
+
+    def rotate_array(self, *args):
+        return self.geometry.rotate_array(*args, br=self.br)
+
+    @property
+    def shape_cache(self):
+        """ the ShapeCache of the grid, None if it is not enabled """
+        return self._shape_cache
+
+    def enable_shape_cache(self, max_cells=100000):
+        """ read the lines, zones, rings, triangles and rectangles from
+        a cache of shape templates holding up to 'max_cells' cells (see ShapeCache)
+        return the ShapeCache """
+        self._shape_cache = ShapeCache(max_cells)
+        return self._shape_cache
+
+    def disable_shape_cache(self):
+        self._shape_cache = None
+
     # painting
     def _compare_cells(self, x1, y1, x2, y2):
         return True
 
     # pathfinding
+    def cost(self, x, y):
+        """ return the cost to move to the (x, y) cell, read from the cost layer """
+        if not (x, y) in self:
+            raise ValueError("{} is out of the grid".format((x, y)))
+        return self._costs[y * self._width + x]
+
+    def set_cost(self, x, y, cost):
+        """ set the cost to move to the (x, y) cell in the cost layer
+        a negative or infinite cost makes the cell impassable """
+        if not (x, y) in self:
+            raise ValueError("{} is out of the grid".format((x, y)))
+        index = y * self._width + x
+        previous = self._costs[index]
+        self._costs[index] = cost
+        if self._cost_counts is not None:
+            # update the counts with the stored value (converted to a float by the array)
+            self._uncount_cost(previous)
+            self._count_cost(self._costs[index])
+        self.cost_changed((x, y))
+
     def movingcost(self, from_x, from_y, to_x, to_y):
-        return 1
+        """ return the cost to move from (from_x, from_y) to (to_x, to_y):
+        by default, the cost of the destination cell in the cost layer.
+        A negative or infinite cost means the move is impossible.
+        This method can be overridden, but the pathfinding will then
+        have to call it for each move, which is much slower than reading the cost layer """
+        return self._costs[to_y * self._width + to_x]
+
+    def cost_changed(self, *cells):
+        """ notify the grid that the moving costs to or from the given (x, y) cells changed,
+        or that all the costs may have changed if no cell is given.
+        'set_cost' calls it itself: call it if you override 'movingcost' and
+        the state it depends on changes """
+        self._version += 1
+        for observer in list(self._observers):
+            observer.cells_changed(cells or None)
+
+    @property
+    def version(self):
+        """ a counter increased each time the moving costs change (see 'cost_changed') """
+        return self._version
+
+    def attach(self, observer):
+        """ register an object which has to be notified when moving costs change
+        ('observer.cells_changed(cells)' will be called, 'cells' being None if
+        all the costs may have changed). The grid only keeps a weak reference """
+        self._observers.add(observer)
 
-    def path(self, from_x, from_y, to_x, to_y):
-        return Pathfinder.a_star(self, (from_x, from_y), (to_x, to_y))
+    def passable(self, x, y):
+        """ return True if the (x, y) cell can be entered, i.e. if its cost in
+        the cost layer is positive and finite.
+        The connectivity index of the grid relies on it: if you override 'movingcost',
+        a cell for which 'passable' returns False should never be entered """
+        cost = self._costs[y * self._width + x]
+        return 0 <= cost < inf
+
+    @property
+    def fast_costs(self):
+        """ the cost layer, if the moving costs only depend on it (i.e. 'movingcost'
+        is not overridden), else None. Used by the pathfinding to avoid calling
+        'movingcost' for each move """
+        if type(self).movingcost is BaseGrid.movingcost:
+            return self._costs
+        return None
+
+    def _count_costs(self):
+        """ count the cells of each passable cost of the cost layer
+        the whole layer is read: this is only done once after it is replaced or resized,
+        'set_cost' then updates the counts """
+        counts = Counter(self._costs)
+        for cost in [cost for cost in counts if not 0 <= cost < inf]:
+            del counts[cost]
+        self._cost_counts = counts
+        self._min_cost = None
+
+    def _count_cost(self, cost):
+        if 0 <= cost < inf:
+            self._cost_counts[cost] += 1
+            if self._min_cost is not None and cost < self._min_cost:
+                self._min_cost = cost
+
+    def _uncount_cost(self, cost):
+        if 0 <= cost < inf:
+            self._cost_counts[cost] -= 1
+            if not self._cost_counts[cost]:
+                del self._cost_counts[cost]
+                if cost == self._min_cost:
+                    self._min_cost = None
+
+    def _passable_costs(self):
+        """ return the Counter of the costs of the passable cells in the cost layer """
+        if self._cost_counts is None:
+            self._count_costs()
+        return self._cost_counts
+
+    @property
+    def uniform_cost(self):
+        """ the cost shared by all the passable cells of the cost layer,
+        or None if the costs are not uniform """
+        values = self._passable_costs()
+        if len(values) == 1:
+            return next(iter(values))
+        return None
+
+    @property
+    def min_cost(self):
+        """ the lowest cost of the passable cells of the cost layer (0 if there is none).
+        The pathfinding uses it as a lower bound of the moving costs to keep its
+        heuristics admissible: override it along with 'movingcost' if a move
+        can cost less than that """
+        values = self._passable_costs()
+        if not values:
+            return 0
+        if self._min_cost is None:
+            # only read again when the lowest cost is no longer used
+            self._min_cost = min(values)
+        return self._min_cost
+
+    @property
+    def connectivity(self):
+        """ the ConnectivityIndex of the grid, built on first use: once built,
+        the searches use it to reject the unreachable targets """
+        return ConnectivityIndex.of(self)
+
+    def path(self, from_x, from_y, to_x, to_y, engine="a_star", **options):
+        """ return the cheapest path from (from_x, from_y) to (to_x, to_y)
+        'engine' is one of the Pathfinder.ENGINES, 'options' are passed to it
+        (e.g. max_expansions or time_budget to bound the a_star and anytime searches)
+        if the connectivity index is built, the targets which can not be reached are rejected at once
+        if the path cache is enabled, the result of a repeated query is read from it
+        (except if an option can not be hashed, the query being run directly then) """
+        cache = self._path_cache
+        if cache is None or "time_budget" in options or "stats" in options:
+            return Pathfinder.search(self, (from_x, from_y), (to_x, to_y), engine, **options)
+        key = (from_x, from_y, to_x, to_y, self._version, getattr(self.geometry, "_nodiags", None),
+               engine, tuple(sorted(options.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return Pathfinder.search(self, (from_x, from_y), (to_x, to_y), engine, **options)
+        return cache.get(key, lambda: Pathfinder.search(self, (from_x, from_y), (to_x, to_y), engine, **options))
+
+    def smooth_path(self, path, run_length=False):
+        """ return the waypoints of the path, the redundant intermediate cells being dropped
+        (see Pathfinder.smooth), or if 'run_length' is True, the (origin, runs) run-length
+        encoding of the smoothed path (see Pathfinder.run_length) """
+        waypoints = Pathfinder.smooth(self, path)
+        if run_length:
+            return Pathfinder.run_length(self, Pathfinder.expand(self, waypoints))
+        return waypoints
+
+    @property
+    def path_cache(self):
+        """ the PathCache of the grid, None if it is not enabled """
+        return self._path_cache
+
+    def enable_path_cache(self, size=1024):
+        """ keep the results of the last 'size' path queries (see 'path'),
+        the entries being invalidated as soon as the moving costs change
+        return the PathCache """
+        self._path_cache = PathCache(size)
+        return self._path_cache
+
+    def disable_path_cache(self):
+        self._path_cache = None
+
+    def paths(self, pairs, workers=None, engine="a_star"):
+        """ return the paths for a list of ((from_x, from_y), (to_x, to_y)) pairs, in the same order
+        the result of a failed query is the exception (e.g. NoPathFound) instead of a path
+        see Pathfinder.paths """
+        return Pathfinder.paths(self, pairs, workers, engine)
+
+    def nearest(self, origin, targets, max_cost=None):
+        """ return the (target, path) tuple of the cheapest of the (x, y) targets to reach
+        from the (x, y) origin, with a single search (see Pathfinder.nearest) """
+        return Pathfinder.nearest(self, origin, targets, max_cost)
+
+    def nearest_origin(self, origins, target, max_cost=None):
+        """ return the (origin, path) tuple of the (x, y) origin from which the (x, y) target
+        is the cheapest to reach, with a single search (see Pathfinder.nearest_origin) """
+        return Pathfinder.nearest_origin(self, origins, target, max_cost)
+
+    def cooperative_paths(self, units, max_time=None):
+        """ plan the paths of several units, given as ((from_x, from_y), (to_x, to_y)) pairs,
+        so that they never stand on the same cell at the same time step
+        the first units have the priority, see CooperativePathfinder.plan """
+        return CooperativePathfinder(self, max_time).plan(units)
+
+    def reachable(self, x, y, budget):
+        """ return the MoveRange of the cells which can be reached from (x, y)
+        within the cost budget, with their costs and the paths to them """
+        return Pathfinder.reachable(self, (x, y), budget)
+
+    def flow_field(self, target, max_cost=None):
+        """ return a FlowField toward the (x, y) target, giving the cost and the
+        path to reach it from every cell of the grid (see Pathfinder.flow_field) """
+        return Pathfinder.flow_field(self, target, max_cost)
 
 class SquareGrid(BaseGrid):
     """ Square grid object """
@@ -147,3 +454,93 @@ class FHexGrid(HexGrid):
     geometry = FHexGeometry
     def __init__(self, *args, **kwargs):
         HexGrid.__init__(self, *args, **kwargs)
+
+class LayeredGrid(object):
+    """ Stack of grids (the levels, indexed by their z coordinate), linked by connectors
+    such as stairs or ramps: a connector is a move from a cell of a level to a cell of
+    an other level, with its own cost.
+
+    usage:
+
+        dungeon = LayeredGrid([SquareGrid(30, 30), SquareGrid(30, 30)])
+        dungeon.connect(5, 5, 0, 5, 5, 1, cost=3)
+        path = dungeon.path(0, 0, 0, 10, 10, 1)
+        >> [(0, 0, 0), (1, 1, 0), ... (5, 5, 0), (5, 5, 1), ... (10, 10, 1)]
+    """
+    def __init__(self, levels):
+        """ instanciate a new LayeredGrid object from a list of grids sharing the same geometry """
+        levels = list(levels)
+        if not levels:
+            raise ValueError("a layered grid needs at least one level")
+        if any(level.geometry is not levels[0].geometry for level in levels):
+            raise ValueError("all the levels have to share the same geometry")
+        self._levels = levels
+        self._connectors = {}
+        # distances to the connectors, see Pathfinder.layered_a_star
+        self._connector_tables = None
+
+    def __repr__(self):
+        return "<{} object>".format(self.__class__.__name__)
+
+    def __len__(self):
+        return len(self._levels)
+
+    def __getitem__(self, z):
+        return self._levels[z]
+
+    def __contains__(self, key):
+        x, y, z = key
+        return 0 <= z < len(self._levels) and (x, y) in self._levels[z]
+
+    def assert_in_grid(self, *cells):
+        """ raise a ValueError if the cells are not valid (x, y, z) coordinates of the grid """
+        for cell in cells:
+            try:
+                x, y, z = cell
+            except (TypeError, ValueError):
+                raise ValueError("'{}' is not a valid (x, y, z) coordinates iterable".format(cell))
+            BaseGeometry.assertCoordinates((x, y), (z, z))
+            if not cell in self:
+                raise ValueError("{} is out of the grid".format(tuple(cell)))
+
+    @property
+    def levels(self):
+        """ the list of the levels, z being the index in the list """
+        return list(self._levels)
+
+    @property
+    def geometry(self):
+        """ the geometry shared by the levels """
+        return self._levels[0].geometry
+
+    def connect(self, x1, y1, z1, x2, y2, z2, cost=1, both_ways=True):
+        """ add a connector from (x1, y1, z1) to (x2, y2, z2), moving through it costs 'cost'
+        if 'both_ways' is True, the reverse connector is added too """
+        self.assert_in_grid((x1, y1, z1), (x2, y2, z2))
+        if not 0 <= cost < inf:
+            raise ValueError("cost has to be a positive number (given: {})".format(cost))
+        self._connectors.setdefault((x1, y1, z1), {})[(x2, y2, z2)] = cost
+        if both_ways:
+            self._connectors.setdefault((x2, y2, z2), {})[(x1, y1, z1)] = cost
+        self._connector_tables = None
+
+    def disconnect(self, x1, y1, z1, x2, y2, z2, both_ways=True):
+        """ remove the connector from (x1, y1, z1) to (x2, y2, z2) (and the reverse one) """
+        links = [((x1, y1, z1), (x2, y2, z2))]
+        if both_ways:
+            links.append(((x2, y2, z2), (x1, y1, z1)))
+        for origin, target in links:
+            connectors = self._connectors.get(origin, {})
+            connectors.pop(target, None)
+            if not connectors:
+                self._connectors.pop(origin, None)
+        self._connector_tables = None
+
+    def connectors(self, x, y, z):
+        """ list of the (x, y, z, cost) connectors from the (x, y, z) cell """
+        return [(*target, cost) for target, cost in self._connectors.get((x, y, z), {}).items()]
+
+    def path(self, from_x, from_y, from_z, to_x, to_y, to_z):
+        """ return the cheapest path from (from_x, from_y, from_z) to (to_x, to_y, to_z),
+        as a list of (x, y, z) coordinates (see Pathfinder.layered_a_star) """
+        return Pathfinder.layered_a_star(self, (from_x, from_y, from_z), (to_x, to_y, to_z))
@@ -7,7 +7,7 @@
 import unittest
 
 from pypog.geometry_objects import FHexGeometry, SquareGeometry, BaseGeometry, \
-    BoundingRect, inf
+    BoundingRect, ShapeCache, inf
 
 
 class Test(unittest.TestCase):
@@ -66,6 +66,30 @@ class Test(unittest.TestCase):
         SquareGeometry.set_no_diags(True)
         self.assertCountEqual(SquareGeometry.neighbors(3, 3), [(2, 3), (3, 2), (4, 3), (3, 4)])
 
+    def test_neighbors_offsets(self):
+        """ test for geometry.neighbors_offsets """
+        for geometry in (SquareGeometry, FHexGeometry):
+            for x, y in ((3, 3), (4, 4)):
+                self.assertCountEqual([(x + dx, y + dy) for dx, dy in geometry.neighbors_offsets(x % 2)],
+                                      geometry.neighbors(x, y))
+        self.assertCountEqual(FHexGeometry.neighbors_offsets(0), [(0, -1), (1, -1), (1, 0), (0, 1), (-1, 0), (-1, -1)])
+        self.assertCountEqual(FHexGeometry.neighbors_offsets(1), [(0, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0)])
+        SquareGeometry.set_no_diags(True)
+        self.assertCountEqual(SquareGeometry.neighbors_offsets(), [(0, -1), (-1, 0), (1, 0), (0, 1)])
+
+    def test_distance(self):
+        """ test for geometry.distance """
+        self.assertRaises(NotImplementedError, BaseGeometry.distance, 0, 0, 1, 1)
+        for geometry in (SquareGeometry, FHexGeometry):
+            for radius in range(4):
+                for x, y in geometry.zone(3, 3, radius):
+                    self.assertLessEqual(geometry.distance(3, 3, x, y), radius)
+                    self.assertEqual(geometry.distance(3, 3, x, y), geometry.distance(x, y, 3, 3))
+        self.assertEqual(SquareGeometry.distance(0, 0, 3, 5), 5)
+        self.assertEqual(FHexGeometry.distance(3, 3, 5, 4), 2)
+        SquareGeometry.set_no_diags(True)
+        self.assertEqual(SquareGeometry.distance(0, 0, 3, 5), 8)
+
     def test_zone(self):
         """ test for geometry.zone """
         self.assertRaises(ValueError, BaseGeometry.zone, "a", 0, 1)
@@ -85,6 +109,37 @@ class Test(unittest.TestCase):
                                                                 (5, 1), (2, 5), (3, 5), (5, 3), (1, 2), (3, 3), (5, 5), (4, 4), (3, 1), \
                                                                 (1, 5), (4, 3), (2, 2), (4, 1), (5, 2), (3, 4), (1, 1)])
 
+    def test_zone_rings(self):
+        """ the zone is the union of the neighbors rings """
+        for geometry in (SquareGeometry, FHexGeometry):
+            for nodiags in (False, True):
+                SquareGeometry.set_no_diags(nodiags)
+                for x, y in ((0, 0), (3, 3), (4, 3), (-3, -2)):
+                    expected = {(x, y)}
+                    for radius in range(6):
+                        zone = geometry.zone(x, y, radius)
+                        self.assertEqual(len(zone), len(set(zone)))
+                        self.assertEqual(set(zone), expected)
+
+                        ring = geometry.ring(x, y, radius)
+                        self.assertEqual(len(ring), len(set(ring)))
+                        self.assertEqual(set(ring), {cell for cell in zone if geometry.distance(x, y, *cell) == radius})
+
+                        expected = expected.union(*[geometry.neighbors(*cell) for cell in expected])
+
+    def test_ring(self):
+        """ test for geometry.ring """
+        self.assertRaises(ValueError, SquareGeometry.ring, "a", 0, 1)
+        self.assertRaises(ValueError, FHexGeometry.ring, 0, 0, -1)
+
+        self.assertCountEqual(SquareGeometry.ring(3, 3, 0), [(3, 3)])
+        self.assertCountEqual(SquareGeometry.ring(3, 3, 1), SquareGeometry.neighbors(3, 3))
+        self.assertCountEqual(FHexGeometry.ring(3, 3, 1), FHexGeometry.neighbors(3, 3))
+        self.assertEqual(len(FHexGeometry.ring(3, 3, 5)), 30)
+        self.assertEqual(len(SquareGeometry.ring(3, 3, 5)), 40)
+        SquareGeometry.set_no_diags(True)
+        self.assertCountEqual(SquareGeometry.ring(3, 3, 2), [(1, 3), (2, 2), (2, 4), (3, 1), (3, 5), (4, 2), (4, 4), (5, 3)])
+
     # # lines
 
     def test_line2d(self):
@@ -205,6 +260,15 @@ class Test(unittest.TestCase):
             for i in geometry.ANGLES:
                 self.assertCountEqual(geometry.triangle(0, 0, 0, 0, i), [(0, 0)])
 
+        # long cones (same results as the previous filling by list-membership)
+        self.assertEqual(len(SquareGeometry.triangle(0, 0, 60, 20, 1)), 2442)
+        self.assertEqual(len(FHexGeometry.triangle(0, 0, 60, 20, 1)), 3706)
+
+        # the top of the cone is on the same row as the base
+        cells = SquareGeometry.triangle(3, 13, 14, -9, 1)
+        self.assertIn((3, 13), cells)
+        self.assertIn((14, -9), cells)
+
     def test_triangle3d(self):
         """ test for geometry.triangle3d """
         for geometry in (SquareGeometry, FHexGeometry):
@@ -268,5 +332,137 @@ class Test(unittest.TestCase):
             result = SquareGeometry.rotate((6, 6), [(6, 6), (6, 5), (5, 5), (5, 6)], i)
             self.assertCountEqual(result, attended[i])
 
+    def test_bounding_rect_clipping(self):
+        """ test for the 'br' argument of the geometry methods """
+        br = BoundingRect(0, 0, 9, 9)
+        self.assertEqual(list(br.columns(-3, 4)), [0, 1, 2, 3, 4])
+        self.assertEqual(list(br.rows(7, 15)), [7, 8, 9])
+        self.assertEqual(br.clip([(-1, 0), (0, 0), (10, 5), (9, 9)]), [(0, 0), (9, 9)])
+        self.assertEqual(br.clip_line([(-1, 0), (0, 0), (1, 0), (1, -1), (2, 0)]), [(0, 0), (1, 0)])
+
+        def clipped(cells):
+            return [cell for cell in cells if cell in br]
+
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for geometry in (SquareGeometry, FHexGeometry):
+                for x, y in ((0, 0), (9, 4), (5, 5), (-2, 11), (12, 3)):
+                    self.assertEqual(geometry.neighbors(x, y, br=br), clipped(geometry.neighbors(x, y)))
+                    for radius in (0, 1, 3):
+                        self.assertEqual(geometry.zone(x, y, radius, br=br), clipped(geometry.zone(x, y, radius)))
+                        self.assertEqual(geometry.ring(x, y, radius, br=br), clipped(geometry.ring(x, y, radius)))
+                    for x2, y2 in ((x, y), (x + 7, y - 3), (x - 4, y + 9), (x + 1, y - 12)):
+                        args = (x, y, x2, y2)
+                        self.assertEqual(geometry.rectangle(*args, br=br), clipped(geometry.rectangle(*args)))
+                        self.assertEqual(geometry.hollow_rectangle(*args, br=br), clipped(geometry.hollow_rectangle(*args)))
+                        self.assertEqual(geometry.line(*args, br=br), br.clip_line(geometry.line(*args)))
+                        self.assertEqual(geometry.triangle(*args, 2, br=br), clipped(geometry.triangle(*args, 2)))
+                        self.assertEqual(geometry.rotate((x, y), [(x2, y2), (x, y)], 1, br=br),
+                                         clipped(geometry.rotate((x, y), [(x2, y2), (x, y)], 1)))
+                    self.assertEqual(geometry.triangle3d(x, y, 0, 5, 5, 3, 1, br=br),
+                                     {cell: z for cell, z in geometry.triangle3d(x, y, 0, 5, 5, 3, 1).items() if cell in br})
+                    self.assertEqual(geometry.line3d(x, y, 0, 15, 3, 8, br=br),
+                                     br.clip_line(geometry.line3d(x, y, 0, 15, 3, 8)))
+
+        # square lines stop at the border
+        self.assertEqual(SquareGeometry.line(5, 5, 15, 5, br=br), [(x, 5) for x in range(5, 10)])
+        self.assertEqual(SquareGeometry.line(15, 5, 5, 5, br=br), [(x, 5) for x in range(9, 4, -1)])
+
+    def test_arrays(self):
+        """ test for the '_array' methods """
+        br = BoundingRect(0, 0, 9, 9)
+        def flat(cells):
+            return [value for cell in cells for value in cell]
+
+        self.assertEqual(SquareGeometry.rectangle_array(1, 1, 2, 3).tolist(), [1, 1, 1, 2, 1, 3, 2, 1, 2, 2, 2, 3])
+        self.assertEqual(SquareGeometry.rectangle_array(1, 1, 2, 3).typecode, "i")
+
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for geometry in (SquareGeometry, FHexGeometry):
+                for x, y in ((0, 0), (5, 4), (-2, 11)):
+                    for radius in (0, 1, 3):
+                        self.assertEqual(geometry.zone_array(x, y, radius).tolist(), flat(geometry.zone(x, y, radius)))
+                        self.assertEqual(geometry.zone_array(x, y, radius, br).tolist(), flat(geometry.zone(x, y, radius, br)))
+                    for x2, y2 in ((x, y), (x + 7, y - 3), (x - 4, y + 9)):
+                        args = (x, y, x2, y2)
+                        for name in ("line", "rectangle", "hollow_rectangle"):
+                            self.assertEqual(getattr(geometry, name + "_array")(*args).tolist(),
+                                             flat(getattr(geometry, name)(*args)))
+                            self.assertEqual(getattr(geometry, name + "_array")(*args, br=br).tolist(),
+                                             flat(getattr(geometry, name)(*args, br=br)))
+                        self.assertEqual(geometry.triangle_array(*args, 1, br=br).tolist(), flat(geometry.triangle(*args, 1, br=br)))
+                        self.assertEqual(geometry.rotate_array((x, y), [(x2, y2)], 1).tolist(),
+                                         flat(geometry.rotate((x, y), [(x2, y2)], 1)))
+            self.assertRaises(ValueError, geometry.zone_array, 0, 0, -1)
+            self.assertRaises(ValueError, geometry.triangle_array, 0, 0, 1, 1, 4)
+
+    def test_lines(self):
+        """ test for geometry.lines """
+        br = BoundingRect(0, 0, 9, 9)
+        origins = [(0, 0), (5, 5), (3, 8), (9, 1), (-3, 4)]
+        targets = [(7, 3), (5, 5), (1, -2), (0, 9), (12, 6)]
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for geometry in (SquareGeometry, FHexGeometry):
+                for rect in (BoundingRect(), br):
+                    cells, offsets = geometry.lines(origins, targets, rect)
+                    self.assertEqual((cells.typecode, len(offsets), offsets[0]), ("i", len(origins) + 1, 0))
+                    for i, (origin, target) in enumerate(zip(origins, targets)):
+                        line = geometry.line(*origin, *target, br=rect)
+                        self.assertEqual(cells[2 * offsets[i]:2 * offsets[i + 1]].tolist(),
+                                         [value for cell in line for value in cell])
+
+                # a single origin
+                cells, offsets = geometry.lines((2, 3), targets)
+                self.assertEqual(cells[2 * offsets[2]:2 * offsets[3]].tolist(),
+                                 [value for cell in geometry.line(2, 3, 1, -2) for value in cell])
+
+                self.assertEqual([len(values) for values in geometry.lines([], [])], [0, 1])
+                self.assertRaises(ValueError, geometry.lines, origins, targets[:2])
+                self.assertRaises(ValueError, geometry.lines, [(0, 0)], [(0, "a")])
+                self.assertRaises(ValueError, geometry.lines, (0, 0), [(1.5, 0)])
+
+    def test_shape_cache(self):
+        """ test for ShapeCache """
+        self.assertRaises(ValueError, ShapeCache, 0)
+
+        cache = ShapeCache()
+        for geometry in (SquareGeometry, FHexGeometry):
+            for x, y in ((0, 0), (7, 3), (4, -2), (-3, 9)):
+                self.assertEqual(cache.line(geometry, x, y, x + 5, y - 3), geometry.line(x, y, x + 5, y - 3))
+                self.assertEqual(cache.zone(geometry, x, y, 2), geometry.zone(x, y, 2))
+                self.assertEqual(cache.ring(geometry, x, y, 2), geometry.ring(x, y, 2))
+                self.assertEqual(cache.triangle(geometry, x, y, x + 2, y + 4, 2), geometry.triangle(x, y, x + 2, y + 4, 2))
+                self.assertEqual(cache.rectangle(geometry, x, y, x - 2, y + 3), geometry.rectangle(x, y, x - 2, y + 3))
+                self.assertEqual(cache.hollow_rectangle(geometry, x, y, x + 4, y + 1), geometry.hollow_rectangle(x, y, x + 4, y + 1))
+            self.assertRaises(ValueError, cache.zone, geometry, 0, 0, -1)
+            self.assertRaises(ValueError, cache.line, geometry, 0, "a", 1, 1)
+
+        # square templates are shared by all the origins, hex ones by the origins of a same parity
+        # (the hex triangles are not cached)
+        self.assertEqual(cache.misses, 6 + 5 * 2)
+        self.assertEqual(cache.hits, 4 * 6 - 6 + 4 * 5 - 5 * 2)
+
+        # the diagonals setting is part of the key
+        SquareGeometry.set_no_diags(True)
+        self.assertEqual(cache.zone(SquareGeometry, 3, 3, 1), SquareGeometry.zone(3, 3, 1))
+        SquareGeometry.set_no_diags(False)
+        self.assertEqual(cache.zone(SquareGeometry, 3, 3, 1), SquareGeometry.zone(3, 3, 1))
+
+        # least recently used templates are evicted above the cells limit
+        cache = ShapeCache(30)
+        cache.zone(SquareGeometry, 0, 0, 1)
+        cache.zone(SquareGeometry, 0, 0, 2)
+        self.assertEqual(cache.stats, {"hits": 0, "misses": 2, "evictions": 1, "templates": 1, "cells": 25})
+        cache.zone(SquareGeometry, 5, 5, 2)
+        self.assertEqual(cache.hits, 1)
+
+        # the shapes larger than the limit are not stored
+        self.assertEqual(len(cache.rectangle(SquareGeometry, 0, 0, 9, 9)), 100)
+        self.assertEqual((len(cache), cache.cells), (1, 25))
+        cache.clear()
+        self.assertEqual((len(cache), cache.cells, cache.hits), (0, 0, 1))
+
 if __name__ == "__main__":
     unittest.main()
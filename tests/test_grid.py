@@ -6,6 +6,7 @@ import unittest
 
 from pypog.geometry_objects import SquareGeometry, FHexGeometry, BoundingRect
 from pypog.grid_objects import BaseGrid, SquareGrid, FHexGrid
+from pypog.pathfinding import NoPathFound
 
 
 class Test(unittest.TestCase):
@@ -66,46 +67,218 @@ class Test(unittest.TestCase):
         grid = BaseGrid(2, 2)
         self.assertCountEqual([(x, y) for x, y in grid], [(0, 0), (0, 1), (1, 0), (1, 1)])
 
+    def test_costs(self):
+        grid = SquareGrid(3, 2)
+        self.assertEqual(list(grid.costs), [1.0] * 6)
+        self.assertEqual(grid.movingcost(0, 0, 1, 1), 1)
+
+        grid.set_cost(1, 1, 2.5)
+        self.assertEqual(grid.cost(1, 1), 2.5)
+        self.assertEqual(grid.costs[4], 2.5)
+        self.assertEqual(grid.movingcost(0, 0, 1, 1), 2.5)
+        self.assertRaises(ValueError, grid.set_cost, 3, 0, 1)
+        self.assertRaises(ValueError, grid.cost, 0, -1)
+
+        # the costs are read back as they were set
+        grid.set_cost(2, 0, 0.1)
+        self.assertEqual(grid.cost(2, 0), 0.1)
+        grid.set_cost(2, 0, 1e40)
+        self.assertEqual(grid.cost(2, 0), 1e40)
+        self.assertTrue(grid.passable(2, 0))
+        grid.set_cost(2, 0, 1)
+
+        # costs of the remaining cells are kept on resize
+        grid.width = 4
+        grid.height = 3
+        self.assertEqual(len(grid.costs), 12)
+        self.assertEqual(grid.cost(1, 1), 2.5)
+        self.assertEqual(grid.cost(3, 2), 1.0)
+
+        grid.costs = range(12)
+        self.assertEqual(grid.cost(1, 2), 9)
+        with self.assertRaises(ValueError):
+            grid.costs = [1, 2]
+
+        # uniformity of the passable cells' costs
+        grid.costs = [1] * 12
+        self.assertEqual(grid.uniform_cost, 1)
+        grid.set_cost(1, 1, -1)
+        self.assertEqual(grid.uniform_cost, 1)
+        grid.set_cost(1, 2, 3)
+        self.assertIsNone(grid.uniform_cost)
+        grid.set_cost(1, 2, 1)
+        self.assertEqual(grid.uniform_cost, 1)
+
+        # lowest cost of the passable cells
+        self.assertEqual(grid.min_cost, 1)
+        grid.set_cost(0, 0, 0.5)
+        self.assertEqual(grid.min_cost, 0.5)
+
+        # the costs are counted once, then updated by set_cost
+        def scan():
+            self.fail("the cost layer was read again")
+        grid._count_costs = scan
+        grid.set_cost(0, 0, 2)
+        self.assertEqual(grid.min_cost, 1)
+        self.assertIsNone(grid.uniform_cost)
+        grid.set_cost(0, 0, 1)
+        grid.set_cost(1, 2, -1)
+        self.assertEqual((grid.min_cost, grid.uniform_cost), (1, 1))
+        for x, y in grid:
+            grid.set_cost(x, y, -1)
+        self.assertEqual((grid.min_cost, grid.uniform_cost), (0, None))
+        grid.set_cost(2, 2, 3)
+        self.assertEqual((grid.min_cost, grid.uniform_cost), (3, 3))
+        del grid._count_costs
+
+        # observers are notified of the changes
+        class Observer():
+            changes = []
+            def cells_changed(self, cells):
+                self.changes.append(cells)
+        observer = Observer()
+        grid.attach(observer)
+        grid.set_cost(2, 2, 5)
+        grid.cost_changed()
+        self.assertEqual(observer.changes, [((2, 2),), None])
+
+        # the cost layer is only read directly if movingcost is not overridden
+        self.assertIs(grid.fast_costs, grid.costs)
+        class CustomGrid(SquareGrid):
+            def movingcost(self, *args):
+                return 2
+        self.assertIsNone(CustomGrid(2, 2).fast_costs)
+
+    def test_path_cache(self):
+        grid = SquareGrid(10, 10)
+        self.assertIsNone(grid.path_cache)
+        cache = grid.enable_path_cache(2)
+        self.assertIs(grid.path_cache, cache)
+
+        path = grid.path(0, 0, 5, 5)
+        self.assertEqual(grid.path(0, 0, 5, 5), path)
+        self.assertEqual(cache.stats, {"hits": 1, "misses": 1, "evictions": 0, "entries": 1})
+
+        # the results are copies
+        grid.path(0, 0, 5, 5).append((9, 9))
+        self.assertEqual(grid.path(0, 0, 5, 5), path)
+
+        # the entries are invalidated when the costs change
+        version = grid.version
+        grid.set_cost(3, 3, -1)
+        self.assertGreater(grid.version, version)
+        self.assertNotIn((3, 3), grid.path(0, 0, 5, 5))
+        self.assertEqual(cache.misses, 2)
+
+        # least recently used entries are evicted
+        grid.path(0, 0, 1, 1)
+        grid.path(0, 0, 2, 2)
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual(len(cache), 2)
+
+        # failed queries are cached too
+        for x, y in grid.neighbors(9, 9):
+            if (x, y) in grid:
+                grid.set_cost(x, y, -1)
+        for _ in range(2):
+            self.assertRaises(NoPathFound, grid.path, 0, 0, 9, 9)
+        self.assertEqual(cache.hits, 4)
+
+        # the diagonal mode of the geometry is part of the key
+        SquareGeometry.set_no_diags(False)
+        self.assertEqual(len(grid.path(0, 0, 4, 2)), 5)
+        SquareGeometry.set_no_diags(True)
+        try:
+            self.assertEqual(len(grid.path(0, 0, 4, 2)), 7)
+        finally:
+            SquareGeometry.set_no_diags(False)
+
+        # the queries with an option which can not be hashed are not cached
+        class Heuristic():
+            __hash__ = None
+            def __call__(self, x1, y1, x2, y2):
+                return 0
+        misses = cache.misses
+        self.assertEqual(len(grid.path(0, 0, 4, 2, heuristic=Heuristic())), 5)
+        self.assertEqual(cache.misses, misses)
+
+        grid.disable_path_cache()
+        self.assertIsNone(grid.path_cache)
+        self.assertRaises(ValueError, grid.enable_path_cache, 0)
+
+    def test_shape_cache(self):
+        grid = FHexGrid(10, 10)
+        self.assertIsNone(grid.shape_cache)
+        cache = grid.enable_shape_cache(1000)
+        self.assertIs(grid.shape_cache, cache)
+
+        self.assertEqual(grid.zone(3, 3, 2), FHexGeometry.zone(3, 3, 2))
+        self.assertEqual(grid.zone(5, 7, 2), FHexGeometry.zone(5, 7, 2))
+        self.assertEqual(grid.line(0, 0, 6, 3), FHexGeometry.line(0, 0, 6, 3))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        # the translated shapes are clipped to the grid
+        self.assertEqual(grid.zone(9, 0, 2), FHexGeometry.zone(9, 0, 2, br=grid.br))
+        self.assertEqual(grid.line(8, 8, 0, 12), FHexGeometry.line(8, 8, 0, 12, br=grid.br))
+
+        grid.disable_shape_cache()
+        self.assertIsNone(grid.shape_cache)
+
     def test_geometry(self):
         # geometrics algorithms are properly tested in tests.test_geometry
         square_grid = SquareGrid(10, 10)
         fhex_grid = FHexGrid(10, 10)
+        br = BoundingRect(0, 0, 9, 9)
 
         args = (0, 0)
-        self.assertEqual(square_grid.neighbors(*args), SquareGeometry.neighbors(*args))
-        self.assertEqual(fhex_grid.neighbors(*args), FHexGeometry.neighbors(*args))
+        self.assertEqual(square_grid.neighbors(*args), SquareGeometry.neighbors(*args, br=br))
+        self.assertEqual(fhex_grid.neighbors(*args), FHexGeometry.neighbors(*args, br=br))
 
         args = (0, 0, 3, 3)
-        self.assertEqual(square_grid.line(*args), SquareGeometry.line(*args))
-        self.assertEqual(fhex_grid.line(*args), FHexGeometry.line(*args))
+        self.assertEqual(square_grid.line(*args), SquareGeometry.line(*args, br=br))
+        self.assertEqual(fhex_grid.line(*args), FHexGeometry.line(*args, br=br))
 
         args = (0, 0, 0, 3, 3, 3)
-        self.assertEqual(square_grid.line3d(*args), SquareGeometry.line3d(*args))
-        self.assertEqual(fhex_grid.line3d(*args), FHexGeometry.line3d(*args))
+        self.assertEqual(square_grid.line3d(*args), SquareGeometry.line3d(*args, br=br))
+        self.assertEqual(fhex_grid.line3d(*args), FHexGeometry.line3d(*args, br=br))
 
         args = (0, 0, 1)
-        self.assertEqual(square_grid.zone(*args), SquareGeometry.zone(*args))
-        self.assertEqual(fhex_grid.zone(*args), FHexGeometry.zone(*args))
+        self.assertEqual(square_grid.zone(*args), SquareGeometry.zone(*args, br=br))
+        self.assertEqual(fhex_grid.zone(*args), FHexGeometry.zone(*args, br=br))
 
         args = (0, 0, 2, 2 , 1)
-        self.assertEqual(square_grid.triangle(*args), SquareGeometry.triangle(*args))
-        self.assertEqual(fhex_grid.triangle(*args), FHexGeometry.triangle(*args))
+        self.assertEqual(square_grid.triangle(*args), SquareGeometry.triangle(*args, br=br))
+        self.assertEqual(fhex_grid.triangle(*args), FHexGeometry.triangle(*args, br=br))
 
         args = (0, 0, 0, 2, 2, 2, 1)
-        self.assertEqual(square_grid.triangle3d(*args), SquareGeometry.triangle3d(*args))
-        self.assertEqual(fhex_grid.triangle3d(*args), FHexGeometry.triangle3d(*args))
+        self.assertEqual(square_grid.triangle3d(*args), SquareGeometry.triangle3d(*args, br=br))
+        self.assertEqual(fhex_grid.triangle3d(*args), FHexGeometry.triangle3d(*args, br=br))
 
         args = (0, 0, 3, 3)
-        self.assertEqual(square_grid.rectangle(*args), SquareGeometry.rectangle(*args))
-        self.assertEqual(fhex_grid.rectangle(*args), FHexGeometry.rectangle(*args))
+        self.assertEqual(square_grid.rectangle(*args), SquareGeometry.rectangle(*args, br=br))
+        self.assertEqual(fhex_grid.rectangle(*args), FHexGeometry.rectangle(*args, br=br))
 
         args = (0, 0, 3, 3)
-        self.assertEqual(square_grid.hollow_rectangle(*args), SquareGeometry.hollow_rectangle(*args))
-        self.assertEqual(fhex_grid.hollow_rectangle(*args), FHexGeometry.hollow_rectangle(*args))
+        self.assertEqual(square_grid.hollow_rectangle(*args), SquareGeometry.hollow_rectangle(*args, br=br))
+        self.assertEqual(fhex_grid.hollow_rectangle(*args), FHexGeometry.hollow_rectangle(*args, br=br))
 
         args = ((5, 5), [(6, 6)], 1)
-        self.assertEqual(square_grid.rotate(*args), SquareGeometry.rotate(*args))
-        self.assertEqual(fhex_grid.rotate(*args), FHexGeometry.rotate(*args))
+        self.assertEqual(square_grid.rotate(*args), SquareGeometry.rotate(*args, br=br))
+        self.assertEqual(fhex_grid.rotate(*args), FHexGeometry.rotate(*args, br=br))
+
+        args = (0, 0, 3, 3)
+        self.assertEqual(square_grid.rectangle_array(*args), SquareGeometry.rectangle_array(*args, br=br))
+        self.assertEqual(fhex_grid.zone_array(0, 0, 2), FHexGeometry.zone_array(0, 0, 2, br=br))
+        args = ([(0, 0), (2, 2)], [(12, 4), (5, -3)])
+        self.assertEqual(square_grid.lines(*args), SquareGeometry.lines(*args, br=br))
+        self.assertEqual(fhex_grid.lines(*args), FHexGeometry.lines(*args, br=br))
+
+        # the cells out of the grid are not returned
+        SquareGeometry.set_no_diags(False)
+        self.assertEqual(square_grid.neighbors(0, 0), [(1, 0), (0, 1), (1, 1)])
+        self.assertEqual(square_grid.zone(9, 9, 1), [(8, 8), (8, 9), (9, 8), (9, 9)])
+        self.assertEqual(square_grid.line(8, 8, 12, 10), [(8, 8), (9, 8)])
+        self.assertEqual(len(fhex_grid.rectangle(-5, -5, 20, 2)), 30)
 
 if __name__ == "__main__":
     unittest.main()
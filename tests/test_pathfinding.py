@@ -0,0 +1,883 @@
+'''
+
+    Tests for 'pathfinding' module
+
+    ** By Cro-Ki l@b, 2017 **
+'''
+import io
+import random
+import unittest
+from heapq import heappop, heappush
+from math import inf
+
+from pypog.geometry_objects import SquareGeometry
+from pypog.grid_objects import SquareGrid, FHexGrid, LayeredGrid
+from pypog.pathfinding import Pathfinder, NoPathFound, FlatPathfinder, Landmarks, \
+    HierarchicalPathfinder, Replanner, ConnectivityIndex, CooperativePathfinder, SearchStats, JumpTable
+
+
+class WalledSquareGrid(SquareGrid):
+    """ square grid with impassable cells """
+    def __init__(self, width, height, walls=()):
+        SquareGrid.__init__(self, width, height)
+        self.walls = set(walls)
+
+    def movingcost(self, from_x, from_y, to_x, to_y):
+        return -1 if (to_x, to_y) in self.walls else 1
+
+class WalledFHexGrid(FHexGrid):
+    """ flat-hexagonal grid with impassable cells """
+    def __init__(self, width, height, walls=()):
+        FHexGrid.__init__(self, width, height)
+        self.walls = set(walls)
+
+    def movingcost(self, from_x, from_y, to_x, to_y):
+        return -1 if (to_x, to_y) in self.walls else 1
+
+
+def cheapest_cost(grid, origin, target):
+    """ cost of the cheapest path from origin to target (plain Dijkstra search), None if there is not """
+    costs = {origin: 0}
+    nodes = [(0, origin)]
+    while nodes:
+        cost, current = heappop(nodes)
+        if current == target:
+            return cost
+        if cost > costs[current]:
+            continue
+        for node in grid.neighbors(*current):
+            if not node in grid:
+                continue
+            movingcost = grid.movingcost(*current, *node)
+            if 0 <= movingcost < inf and cost + movingcost < costs.get(node, inf):
+                costs[node] = cost + movingcost
+                heappush(nodes, (costs[node], node))
+    return None
+
+def path_cost(grid, path):
+    """ sum of the moving costs along the path """
+    return sum(grid.movingcost(*previous, *current) for previous, current in zip(path, path[1:]))
+
+def random_walls(grid, density, seed):
+    """ make a random part of the grid's cells impassable """
+    rand = random.Random(seed)
+    for x, y in grid:
+        if rand.random() < density:
+            grid.set_cost(x, y, -1)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        SquareGeometry.set_no_diags(False)
+
+    def assertValidPath(self, grid, path, origin, target):
+        self.assertEqual(path[0], origin)
+        self.assertEqual(path[-1], target)
+        for previous, current in zip(path, path[1:]):
+            self.assertIn(current, grid.neighbors(*previous))
+            self.assertTrue(current in grid)
+            self.assertGreaterEqual(grid.movingcost(*previous, *current), 0)
+
+    def assertNoCollision(self, units, results):
+        """ the units never stand on the same cell, nor swap their cells: a unit stays on
+        its target once arrived, or on its origin if no path were found """
+        paths = [result if isinstance(result, list) else [origin] for (origin, _), result in zip(units, results)]
+        duration = max(len(path) for path in paths) + 1
+        positions = [path + [path[-1]] * (duration - len(path)) for path in paths]
+        for time in range(duration):
+            cells = [position[time] for position in positions]
+            self.assertEqual(len(set(cells)), len(cells))
+            if time:
+                moves = {(position[time - 1], position[time]) for position in positions}
+                self.assertFalse(any((b, a) in moves for a, b in moves if a != b))
+
+    def test_a_star(self):
+        grid = SquareGrid(30, 30)
+        self.assertEqual(Pathfinder.a_star(grid, (1, 6), (3, 9)), [(1, 6), (1, 7), (2, 8), (3, 9)])
+        self.assertEqual(Pathfinder.a_star(grid, (1, 6), (1, 6)), [(1, 6)])
+        self.assertEqual(grid.path(1, 6, 3, 9), [(1, 6), (1, 7), (2, 8), (3, 9)])
+
+        self.assertRaises(ValueError, Pathfinder.a_star, grid, ("a", 0), (1, 1))
+        self.assertRaises(ValueError, Pathfinder.a_star, grid, (0, 0), (30, 1))
+        self.assertRaises(ValueError, grid.path, 0, 0, 1, 1, "unknown")
+
+        for grid_cls in (WalledSquareGrid, WalledFHexGrid):
+            grid = grid_cls(10, 10, walls=[(5, y) for y in range(9)])
+            path = grid.path(0, 0, 9, 0)
+            self.assertValidPath(grid, path, (0, 0), (9, 0))
+
+    def test_a_star_deterministic(self):
+        grid = SquareGrid(20, 20)
+        SquareGeometry.set_no_diags(True)
+        paths = {tuple(grid.path(0, 0, 15, 12)) for _ in range(5)}
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(len(paths.pop()), 28)
+
+        # the neighbors are read from the offsets table, not rebuilt at each expansion
+        grid.neighbors = None
+        self.assertEqual(len(Pathfinder.a_star(grid, (0, 0), (15, 12))), 28)
+
+    def test_no_path_found(self):
+        # the target is enclosed: the search has to stop once the reachable cells are exhausted
+        walls = [(x, y) for x in range(97, 104) for y in range(97, 104) if (x, y) != (100, 100)]
+        for grid_cls in (WalledSquareGrid, WalledFHexGrid):
+            grid = grid_cls(200, 200, walls=walls)
+            self.assertRaises(NoPathFound, grid.path, 0, 0, 100, 100)
+
+    def test_flat(self):
+        SquareGeometry.set_no_diags(True)
+        walls = [(5, y) for y in range(9)] + [(2, y) for y in range(1, 10)]
+        for grid_cls in (WalledSquareGrid, WalledFHexGrid):
+            grid = grid_cls(10, 10, walls=walls)
+            engine = FlatPathfinder.of(grid)
+            for origin, target in (((0, 0), (9, 0)), ((9, 9), (0, 9)), ((3, 3), (3, 3)), ((0, 5), (8, 8))):
+                path = grid.path(*origin, *target, engine="flat")
+                self.assertValidPath(grid, path, origin, target)
+                self.assertEqual(len(path), len(grid.path(*origin, *target)))
+
+            # buffers are reused from a query to another
+            self.assertIs(FlatPathfinder.of(grid), engine)
+            self.assertRaises(NoPathFound, grid.path, 0, 0, 5, 0, "flat")
+            self.assertEqual(engine.index(3, 2), 23)
+            self.assertEqual(grid[engine.index(3, 2)], (3, 2))
+
+            # buffers are rebuilt if the grid is resized
+            grid.width = 12
+            self.assertIsNot(FlatPathfinder.of(grid), engine)
+
+    def test_cost_layer(self):
+        SquareGeometry.set_no_diags(True)
+        for grid_cls in (SquareGrid, FHexGrid):
+            grid = grid_cls(10, 10)
+
+            # the pathfinding reads the cost layer without calling movingcost
+            def _movingcost(*args):
+                raise AssertionError("movingcost should not be called")
+            grid.movingcost = _movingcost
+
+            for y in range(9):
+                grid.set_cost(5, y, -1)
+            grid.set_cost(5, 9, float("inf"))
+            for engine in Pathfinder.ENGINES:
+                self.assertRaises(NoPathFound, grid.path, 0, 0, 9, 0, engine)
+
+            grid.set_cost(5, 9, 20)
+            for engine in Pathfinder.ENGINES:
+                path = grid.path(0, 0, 9, 0, engine)
+                self.assertIn((5, 9), path)
+
+    def test_jps(self):
+        rand = random.Random(0)
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for seed in range(40):
+                grid = SquareGrid(20, 15)
+                random_walls(grid, 0.3, seed)
+                origin = (rand.randrange(20), rand.randrange(15))
+                target = (rand.randrange(20), rand.randrange(15))
+
+                length = cheapest_cost(grid, origin, target)
+                if length is None:
+                    self.assertRaises(NoPathFound, grid.path, *origin, *target, "jps")
+                    continue
+                path = grid.path(*origin, *target, "jps")
+                self.assertValidPath(grid, path, origin, target)
+                self.assertEqual(len(path) - 1, length)
+
+    def test_jps_open_map(self):
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            grid = SquareGrid(120, 120)
+            for y in range(100):
+                grid.set_cost(60, y, -1)
+
+            # the jump points are read from the table instead of expanding the open areas
+            jps_stats, a_star_stats = SearchStats(), SearchStats()
+            for origin, target in (((0, 0), (119, 0)), ((5, 110), (100, 3)), ((30, 30), (90, 60))):
+                path = grid.path(*origin, *target, "jps", stats=jps_stats)
+                self.assertValidPath(grid, path, origin, target)
+                self.assertEqual(len(path), len(grid.path(*origin, *target, stats=a_star_stats)))
+            self.assertEqual(jps_stats.queries, 3)
+            self.assertLess(10 * jps_stats.expanded, a_star_stats.expanded)
+
+            # the table is built again when the costs change
+            table = JumpTable.of(grid)
+            grid.set_cost(60, 110, -1)
+            path = grid.path(0, 119, 119, 119, "jps")
+            self.assertNotIn((60, 110), path)
+            self.assertIs(JumpTable.of(grid), table)
+            self.assertEqual(table.distances(1, 0)[table.index(59, 0)], 0)
+            self.assertEqual(table.distances(1, 0)[table.index(57, 0)], -2)
+
+    def test_jps_fallback(self):
+        SquareGeometry.set_no_diags(True)
+        # non uniform costs
+        grid = SquareGrid(10, 10)
+        for y in range(9):
+            grid.set_cost(5, y, 10)
+        self.assertIsNone(grid.uniform_cost)
+        self.assertEqual(grid.path(0, 0, 9, 0, "jps"), grid.path(0, 0, 9, 0))
+
+        # overridden movingcost or hexagonal grid
+        for grid_cls in (WalledSquareGrid, WalledFHexGrid):
+            grid = grid_cls(10, 10, walls=[(5, y) for y in range(9)])
+            self.assertEqual(grid.path(0, 0, 9, 0, "jps"), grid.path(0, 0, 9, 0))
+
+    def test_hierarchical(self):
+        rand = random.Random(0)
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for grid_cls in (SquareGrid, FHexGrid):
+                for seed in range(10):
+                    grid = grid_cls(23, 17)
+                    random_walls(grid, 0.25, seed)
+                    HierarchicalPathfinder.of(grid, cluster_size=4)
+                    for _ in range(5):
+                        origin = (rand.randrange(23), rand.randrange(17))
+                        target = (rand.randrange(23), rand.randrange(17))
+                        try:
+                            grid.path(*origin, *target)
+                        except NoPathFound:
+                            self.assertRaises(NoPathFound, grid.path, *origin, *target, "hierarchical")
+                        else:
+                            path = grid.path(*origin, *target, "hierarchical")
+                            self.assertValidPath(grid, path, origin, target)
+
+        self.assertRaises(ValueError, HierarchicalPathfinder, SquareGrid(5, 5), 1)
+
+    def test_hierarchical_update(self):
+        SquareGeometry.set_no_diags(True)
+        grid = SquareGrid(20, 20)
+        engine = HierarchicalPathfinder.of(grid, cluster_size=5)
+        self.assertEqual(len(grid.path(0, 2, 19, 2, "hierarchical")), 20)
+        built = set(engine._graphs)
+
+        # only the clusters around the modified cell are rebuilt
+        for y in range(19):
+            grid.set_cost(12, y, -1)
+        self.assertEqual(set(engine._graphs), built - {(2, y) for y in range(4)})
+
+        path = grid.path(0, 2, 19, 2, "hierarchical")
+        self.assertValidPath(grid, path, (0, 2), (19, 2))
+        self.assertIn((12, 19), path)
+
+        grid.set_cost(12, 19, -1)
+        self.assertRaises(NoPathFound, grid.path, 0, 2, 19, 2, "hierarchical")
+
+    def test_flow_field(self):
+        class SlopeGrid(FHexGrid):
+            """ moving down is cheaper than moving up """
+            def movingcost(self, from_x, from_y, to_x, to_y):
+                return 1 if to_y >= from_y else 3
+
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for grid in (SquareGrid(12, 9), FHexGrid(12, 9), SlopeGrid(12, 9)):
+                random_walls(grid, 0.2, 3)
+                grid.set_cost(5, 4, 1)
+                field = grid.flow_field((5, 4))
+                self.assertEqual(field.path(5, 4), [(5, 4)])
+                self.assertIsNone(field.next_step(5, 4))
+
+                for origin in grid:
+                    cost = cheapest_cost(grid, origin, (5, 4))
+                    if cost is None:
+                        self.assertEqual(field.distance(*origin), inf)
+                        self.assertRaises(NoPathFound, field.path, *origin)
+                        continue
+                    self.assertEqual(field.distance(*origin), cost)
+                    path = field.path(*origin)
+                    self.assertValidPath(grid, path, origin, (5, 4))
+                    self.assertEqual(path_cost(grid, path), cost)
+                    if len(path) > 1:
+                        self.assertEqual(field.next_step(*origin), path[1])
+
+                # limited search
+                field = grid.flow_field((5, 4), max_cost=3)
+                self.assertTrue(all(distance <= 3 or distance == inf for distance in field.distances))
+                self.assertEqual(len(field.distances), len(grid))
+
+    def test_replanner(self):
+        rand = random.Random(1)
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for grid_cls in (SquareGrid, FHexGrid):
+                for seed in range(8):
+                    grid = grid_cls(12, 10)
+                    random_walls(grid, 0.2, seed)
+                    for x, y in grid:
+                        if grid.cost(x, y) >= 0 and rand.random() < 0.2:
+                            grid.set_cost(x, y, rand.choice((0.5, 2, 3)))
+                    target = (rand.randrange(12), rand.randrange(10))
+                    replanner = Replanner(grid, (rand.randrange(12), rand.randrange(10)), target)
+
+                    for _ in range(6):
+                        cost = cheapest_cost(grid, replanner.origin, target)
+                        if cost is None:
+                            self.assertRaises(NoPathFound, replanner.path)
+                        else:
+                            path = replanner.path()
+                            self.assertValidPath(grid, path, replanner.origin, target)
+                            self.assertEqual(path_cost(grid, path), cost)
+                            if len(path) > 1:
+                                replanner.move_to(*path[1])
+
+                        # the grid notifies the replanner of the changes
+                        for _ in range(3):
+                            grid.set_cost(rand.randrange(12), rand.randrange(10), rand.choice((-1, 1, 2)))
+
+    def test_replanner_update(self):
+        SquareGeometry.set_no_diags(True)
+        walls = set()
+        grid = WalledFHexGrid(10, 10, walls)
+        replanner = Replanner(grid, (0, 0), (9, 0))
+        self.assertEqual(path_cost(grid, replanner.path()), cheapest_cost(grid, (0, 0), (9, 0)))
+
+        # movingcost is overridden: the changes have to be notified
+        grid.walls |= {(5, y) for y in range(9)}
+        replanner.update(*grid.walls)
+        path = replanner.path()
+        self.assertValidPath(grid, path, (0, 0), (9, 0))
+        self.assertEqual(path_cost(grid, path), cheapest_cost(grid, (0, 0), (9, 0)))
+
+        grid.walls.add((5, 9))
+        grid.cost_changed((5, 9))
+        self.assertRaises(NoPathFound, replanner.path)
+
+        self.assertRaises(ValueError, Replanner, grid, (0, 0), (10, 0))
+
+    def test_replanner_repair(self):
+        SquareGeometry.set_no_diags(False)
+        grid = SquareGrid(20, 20)
+        for y in range(20):
+            grid.set_cost(10, y, 2)
+        replanner = Replanner(grid, (0, 5), (19, 5))
+        replanner.path()
+
+        # a change is repaired without reading the whole cost layer, nor restarting the search
+        def fail(*args):
+            self.fail("the search was restarted or the cost layer was read again")
+        grid._count_costs = fail
+        replanner._reset = fail
+        for cost in (3, -1):
+            grid.set_cost(10, 5, cost)
+            path = replanner.path()
+            self.assertValidPath(grid, path, (0, 5), (19, 5))
+            self.assertEqual(path_cost(grid, path), cheapest_cost(grid, (0, 5), (19, 5)))
+
+        # a lower cost makes the heuristic inadmissible: the search restarts
+        del replanner._reset
+        grid.set_cost(3, 3, 0.5)
+        self.assertEqual(path_cost(grid, replanner.path()), cheapest_cost(grid, (0, 5), (19, 5)))
+
+    def test_connectivity(self):
+        rand = random.Random(2)
+        for nodiags in (False, True):
+            SquareGeometry.set_no_diags(nodiags)
+            for grid_cls in (SquareGrid, FHexGrid):
+                grid = grid_cls(12, 9)
+                random_walls(grid, 0.35, 4)
+                index = grid.connectivity
+                self.assertIs(ConnectivityIndex.of(grid), index)
+
+                for _ in range(40):
+                    # the index is updated incrementally
+                    grid.set_cost(rand.randrange(12), rand.randrange(9), rand.choice((-1, 1)))
+
+                    origin = (rand.randrange(12), rand.randrange(9))
+                    target = (rand.randrange(12), rand.randrange(9))
+                    reachable = cheapest_cost(grid, origin, target) is not None
+                    self.assertEqual(index.connected(origin, target), reachable)
+                    if grid.passable(*origin) and grid.passable(*target):
+                        self.assertEqual(index.label(*origin) == index.label(*target), reachable)
+
+    def test_connectivity_rejects(self):
+        SquareGeometry.set_no_diags(False)
+        grid = SquareGrid(30, 30)
+        for x, y in grid.hollow_rectangle(10, 10, 20, 20):
+            grid.set_cost(x, y, -1)
+
+        # the queries do not build the index
+        self.assertEqual(grid.path(0, 0, 2, 2), [(0, 0), (1, 1), (2, 2)])
+        self.assertIsNone(ConnectivityIndex.built(grid))
+        self.assertFalse(grid.connectivity.connected((0, 0), (15, 15)))
+        self.assertIs(ConnectivityIndex.built(grid), grid.connectivity)
+
+        for engine in Pathfinder.ENGINES:
+            self.assertRaises(NoPathFound, grid.path, 0, 0, 15, 15, engine)
+
+        # the origin cell itself may be impassable
+        self.assertEqual(grid.path(10, 10, 11, 11), [(10, 10), (11, 11)])
+        self.assertEqual(grid.path(10, 10, 9, 9), [(10, 10), (9, 9)])
+
+        grid.set_cost(20, 15, 1)
+        self.assertTrue(grid.connectivity.connected((0, 0), (15, 15)))
+        self.assertEqual(grid.path(0, 0, 15, 15)[-1], (15, 15))
+
+        # an index which is no longer up to date is not rebuilt by the queries
+        grid.cost_changed()
+        self.assertIsNone(ConnectivityIndex.built(grid))
+        grid.connectivity.build()
+        SquareGeometry.set_no_diags(True)
+        self.assertIsNone(ConnectivityIndex.built(grid))
+        self.assertEqual(grid.path(0, 0, 0, 2), [(0, 0), (0, 1), (0, 2)])
+        SquareGeometry.set_no_diags(False)
+        self.assertIs(ConnectivityIndex.built(grid), grid.connectivity)
+
+        # the index is not used by the grids which override movingcost
+        grid = WalledSquareGrid(10, 10, walls=[(5, y) for y in range(10)])
+        grid.connectivity.build()
+        self.assertIsNone(ConnectivityIndex.built(grid))
+        self.assertRaises(NoPathFound, grid.path, 0, 0, 9, 9)
+
+    def test_budget(self):
+        SquareGeometry.set_no_diags(True)
+        grid = SquareGrid(60, 60)
+        for y in range(55):
+            grid.set_cost(30, y, -1)
+
+        # out of budget: the path leads to the expanded cell the closest to the target
+        path = grid.path(0, 0, 59, 0, max_expansions=50)
+        self.assertEqual(path[0], (0, 0))
+        self.assertNotEqual(path[-1], (59, 0))
+        self.assertValidPath(grid, path, (0, 0), path[-1])
+
+        path = grid.path(0, 0, 59, 0, max_expansions=100000, time_budget=10)
+        self.assertEqual(path_cost(grid, path), cheapest_cost(grid, (0, 0), (59, 0)))
+
+        path = Pathfinder.a_star(grid, (0, 0), (59, 0), time_budget=0)
+        self.assertEqual(path, [(0, 0)])
+
+    def test_anytime(self):
+        SquareGeometry.set_no_diags(True)
+        for seed in range(10):
+            grid = SquareGrid(30, 30)
+            random_walls(grid, 0.3, seed)
+            grid.set_cost(0, 0, 1)
+            grid.set_cost(29, 29, 1)
+            expected = cheapest_cost(grid, (0, 0), (29, 29))
+            if expected is None:
+                self.assertRaises(NoPathFound, lambda: list(Pathfinder.anytime_search(grid, (0, 0), (29, 29))))
+                continue
+
+            costs = [path_cost(grid, path) for path in Pathfinder.anytime_search(grid, (0, 0), (29, 29), weight=5)]
+            self.assertEqual(costs, sorted(set(costs), reverse=True))
+            self.assertEqual(costs[-1], expected)
+            self.assertEqual(path_cost(grid, grid.path(0, 0, 29, 29, "anytime")), expected)
+
+        # out of budget before any path is found
+        grid = SquareGrid(30, 30)
+        paths = list(Pathfinder.anytime_search(grid, (0, 0), (29, 29), max_expansions=3))
+        self.assertEqual(len(paths), 1)
+        self.assertNotEqual(paths[0][-1], (29, 29))
+        self.assertRaises(ValueError, Pathfinder.anytime, grid, (0, 0), (29, 29), 0.5)
+
+    def test_heuristics(self):
+        rand = random.Random(2)
+        for grid_cls in (SquareGrid, FHexGrid):
+            for nodiags in (False, True):
+                SquareGeometry.set_no_diags(nodiags)
+                grid = grid_cls(25, 25)
+                for x, y in grid:
+                    grid.set_cost(x, y, rand.choice((1, 1, 2, 5, -1)))
+                cells = [cell for cell in grid if grid.passable(*cell)]
+                estimates = {name: Pathfinder.heuristic(grid, name) for name in ("distance", "landmarks")}
+
+                for _ in range(30):
+                    origin, target = rand.choice(cells), rand.choice(cells)
+                    expected = cheapest_cost(grid, origin, target)
+                    if expected is None:
+                        self.assertRaises(NoPathFound, Pathfinder.a_star, grid, origin, target, heuristic="landmarks")
+                        continue
+                    for name, estimate in estimates.items():
+                        self.assertLessEqual(estimate(*origin, *target), expected)
+                        path = grid.path(*origin, *target, heuristic=name)
+                        self.assertValidPath(grid, path, origin, target)
+                        self.assertEqual(path_cost(grid, path), expected)
+                    for engine in ("flat", "anytime"):
+                        path = grid.path(*origin, *target, engine, heuristic="landmarks")
+                        self.assertEqual(path_cost(grid, path), expected)
+
+        grid = SquareGrid(10, 10)
+        self.assertEqual(len(Landmarks.of(grid, 3).landmarks), 3)
+        self.assertEqual(Pathfinder.a_star(grid, (0, 0), (3, 3), heuristic=lambda *args: 0)[-1], (3, 3))
+        self.assertRaises(ValueError, Pathfinder.a_star, grid, (0, 0), (3, 3), heuristic="unknown")
+
+        # the default heuristic reads the lowest cost without reading the cost layer again
+        def fail():
+            self.fail("the cost layer was read again")
+        SquareGeometry.set_no_diags(False)
+        grid = SquareGrid(40, 40)
+        grid._count_costs = fail
+        self.assertEqual(len(grid.path(0, 0, 3, 3)), 4)
+        del grid._count_costs
+        grid.set_cost(5, 5, 3)
+        grid.path(0, 0, 3, 3)
+        grid._count_costs = fail
+        for cost in (0.5, 2, -1, 1):
+            grid.set_cost(1, 1, cost)
+            self.assertEqual(path_cost(grid, grid.path(0, 0, 3, 3)), cheapest_cost(grid, (0, 0), (3, 3)))
+
+        # the landmarks follow the changes of the grid
+        estimate = Pathfinder.heuristic(grid, "landmarks")
+        self.assertEqual(estimate(0, 5, 9, 5), 9)
+        for y in range(9):
+            grid.set_cost(5, y, -1)
+        self.assertEqual(Pathfinder.heuristic(grid, "landmarks")(0, 5, 9, 5), cheapest_cost(grid, (0, 5), (9, 5)))
+
+    def test_bidirectional(self):
+
+        class SlopeGrid(SquareGrid):
+            """ climbing up costs more than going down """
+            def movingcost(self, from_x, from_y, to_x, to_y):
+                cost = self.cost(to_x, to_y)
+                return cost + 3 * max(0, from_y - to_y) if cost >= 0 else cost
+
+        rand = random.Random(5)
+        for grid_cls in (SquareGrid, FHexGrid, SlopeGrid):
+            for nodiags in (False, True):
+                SquareGeometry.set_no_diags(nodiags)
+                grid = grid_cls(20, 17)
+                for x, y in grid:
+                    grid.set_cost(x, y, rand.choice((1, 1, 2, 4, -1)))
+                for _ in range(20):
+                    origin = (rand.randrange(20), rand.randrange(17))
+                    target = rand.choice([cell for cell in grid if grid.passable(*cell)])
+                    expected = cheapest_cost(grid, origin, target)
+                    if expected is None:
+                        self.assertRaises(NoPathFound, Pathfinder.bidirectional, grid, origin, target)
+                        continue
+                    path = Pathfinder.bidirectional(grid, origin, target)
+                    self.assertValidPath(grid, path, origin, target)
+                    self.assertEqual(path_cost(grid, path), expected)
+
+        SquareGeometry.set_no_diags(False)
+        grid = SquareGrid(10, 10)
+        self.assertEqual(grid.path(3, 3, 3, 3, "bidirectional"), [(3, 3)])
+        self.assertEqual(len(grid.path(0, 0, 9, 9, "bidirectional", heuristic="landmarks")), 10)
+
+        # the searches meet in the middle instead of crossing the whole map:
+        # as many expansions as a_star on an open map, fewer with a few walls
+        for density in (0, 0.1):
+            bidirectional, a_star = SearchStats(), SearchStats()
+            for grid_cls in (SquareGrid, FHexGrid):
+                for seed in range(3):
+                    grid = grid_cls(60, 60)
+                    random_walls(grid, density, seed)
+                    cells = [cell for cell in grid if grid.passable(*cell)]
+                    for _ in range(10):
+                        origin, target = rand.choice(cells), rand.choice(cells)
+                        if cheapest_cost(grid, origin, target) is None:
+                            continue
+                        path = grid.path(*origin, *target, "bidirectional", stats=bidirectional)
+                        self.assertEqual(path_cost(grid, path),
+                                         path_cost(grid, grid.path(*origin, *target, stats=a_star)))
+            self.assertEqual(bidirectional.queries, a_star.queries)
+            if density:
+                self.assertLess(bidirectional.expanded, 0.9 * a_star.expanded)
+            else:
+                self.assertLessEqual(bidirectional.expanded, a_star.expanded)
+
+    def test_cooperative(self):
+        SquareGeometry.set_no_diags(True)
+
+        # a corridor, with a bay to let the units pass each other
+        grid = SquareGrid(9, 3)
+        for x, y in grid:
+            if y != 1 and (x, y) != (6, 0):
+                grid.set_cost(x, y, -1)
+        units = [((0, 1), (8, 1)), ((8, 1), (0, 1))]
+        paths = grid.cooperative_paths(units)
+
+        self.assertIn((6, 0), paths[1])
+        for (origin, target), path in zip(units, paths):
+            self.assertEqual(path[0], origin)
+            self.assertEqual(path[-1], target)
+            for previous, current in zip(path, path[1:]):
+                self.assertTrue(current == previous or current in grid.neighbors(*previous))
+                self.assertTrue(grid.passable(*current))
+
+        # the units stay on their target once arrived
+        self.assertNoCollision(units, paths)
+
+        # the target is taken by an other unit
+        planner = CooperativePathfinder(grid)
+        results = planner.plan([((0, 1), (4, 1)), ((8, 1), (4, 1))])
+        self.assertEqual(results[0][-1], (4, 1))
+        self.assertIsInstance(results[1], NoPathFound)
+
+        # a unit which can not reach its target stays on its origin
+        dead_end = SquareGrid(6, 3)
+        for x, y in dead_end:
+            if not (y == 1 and x < 5) and (x, y) != (5, 0):
+                dead_end.set_cost(x, y, -1)
+        results = dead_end.cooperative_paths([((2, 1), (5, 0)), ((0, 1), (4, 1))])
+        self.assertIsInstance(results[0], NoPathFound)
+        self.assertIsInstance(results[1], NoPathFound)
+        results = dead_end.cooperative_paths([((2, 1), (5, 0)), ((0, 1), (1, 1))])
+        self.assertEqual(results[1], [(0, 1), (1, 1)])
+
+        # the paths already planned do not cross the origin of a unit which can not move
+        corridor = SquareGrid(5, 1)
+        corridor.set_cost(4, 0, -1)
+        units = [((0, 0), (3, 0)), ((1, 0), (4, 0))]
+        results = corridor.cooperative_paths(units)
+        self.assertIsInstance(results[1], NoPathFound)
+        self.assertIsInstance(results[0], NoPathFound)
+        self.assertNoCollision(units, results)
+
+        corridor = SquareGrid(4, 1)
+        corridor.set_cost(3, 0, -1)
+        units = [((0, 0), (2, 0)), ((2, 0), (3, 0))]
+        results = corridor.cooperative_paths(units)
+        self.assertIsInstance(results[0], NoPathFound)
+        self.assertNoCollision(units, results)
+
+        rand = random.Random(2)
+        for seed in range(30):
+            crowded = SquareGrid(6, 4)
+            random_walls(crowded, 0.3, seed)
+            cells = list(crowded)
+            rand.shuffle(cells)
+            units = list(zip(cells[:6], cells[6:12]))
+            results = crowded.cooperative_paths(units)
+            self.assertNoCollision(units, results)
+
+        # a unit waits for an other one to clear the way
+        planner = CooperativePathfinder(grid)
+        planner.reserve([(5, 1), (6, 1), (7, 1)], park=False)
+        self.assertFalse(planner.is_free(6, 1, 1))
+        path = planner.search((6, 0), (6, 1))
+        self.assertEqual(path[0], (6, 0))
+        self.assertEqual(path[-1], (6, 1))
+        self.assertGreater(len(path), 2)
+        self.assertRaises(ValueError, CooperativePathfinder, grid, None, -1)
+
+    def test_nearest(self):
+
+        class SlopeGrid(SquareGrid):
+            """ climbing up costs more than going down """
+            def movingcost(self, from_x, from_y, to_x, to_y):
+                cost = self.cost(to_x, to_y)
+                return cost + 3 * max(0, from_y - to_y) if cost >= 0 else cost
+
+        rand = random.Random(8)
+        for grid_cls in (SquareGrid, FHexGrid, SlopeGrid):
+            grid = grid_cls(20, 20)
+            for x, y in grid:
+                grid.set_cost(x, y, rand.choice((1, 1, 3, -1)))
+            for _ in range(10):
+                origin = (rand.randrange(20), rand.randrange(20))
+                cells = [(rand.randrange(20), rand.randrange(20)) for _ in range(5)]
+
+                costs = [cheapest_cost(grid, origin, cell) for cell in cells]
+                costs = [cost for cost in costs if cost is not None]
+                if not costs:
+                    self.assertRaises(NoPathFound, grid.nearest, origin, cells)
+                else:
+                    target, path = grid.nearest(origin, cells)
+                    self.assertIn(target, cells)
+                    self.assertValidPath(grid, path, origin, target)
+                    self.assertEqual(path_cost(grid, path), min(costs))
+
+                costs = [cheapest_cost(grid, cell, origin) for cell in cells]
+                costs = [cost for cost in costs if cost is not None]
+                if not costs:
+                    self.assertRaises(NoPathFound, grid.nearest_origin, cells, origin)
+                else:
+                    start, path = grid.nearest_origin(cells, origin)
+                    self.assertIn(start, cells)
+                    self.assertValidPath(grid, path, start, origin)
+                    self.assertEqual(path_cost(grid, path), min(costs))
+
+        grid = SquareGrid(10, 10)
+        self.assertEqual(grid.nearest((0, 0), [(0, 0), (5, 5)]), ((0, 0), [(0, 0)]))
+        self.assertEqual(grid.nearest((0, 0), [(9, 9), (2, 2)])[0], (2, 2))
+        self.assertRaises(NoPathFound, grid.nearest, (0, 0), [(9, 9)], 5)
+        self.assertRaises(ValueError, grid.nearest, (0, 0), [(10, 10)])
+
+    def test_reachable(self):
+        rand = random.Random(3)
+        for grid_cls in (SquareGrid, FHexGrid):
+            grid = grid_cls(15, 15)
+            for x, y in grid:
+                grid.set_cost(x, y, rand.choice((1, 1, 2, 4, -1)))
+            origin = (7, 7)
+            move_range = grid.reachable(*origin, 6)
+            self.assertIn(origin, move_range)
+            self.assertEqual(move_range.path(*origin), [origin])
+
+            for cell in grid:
+                cost = cheapest_cost(grid, origin, cell)
+                if cost is not None and cost <= 6:
+                    self.assertIn(cell, move_range)
+                    self.assertEqual(move_range.cost(*cell), cost)
+                    path = move_range.path(*cell)
+                    self.assertValidPath(grid, path, origin, cell)
+                    self.assertEqual(path_cost(grid, path), cost)
+                else:
+                    self.assertNotIn(cell, move_range)
+                    self.assertEqual(move_range.cost(*cell), inf)
+                    self.assertRaises(NoPathFound, move_range.path, *cell)
+
+        grid = SquareGrid(10, 10)
+        self.assertEqual(len(grid.reachable(0, 0, 0)), 1)
+        self.assertEqual(set(grid.reachable(0, 0, 1)), {(0, 0), (0, 1), (1, 0), (1, 1)})
+
+    def test_smooth(self):
+        rand = random.Random(1)
+        for grid_cls in (SquareGrid, FHexGrid):
+            for nodiags in (False, True):
+                SquareGeometry.set_no_diags(nodiags)
+                grid = grid_cls(30, 30)
+                random_walls(grid, 0.15, 4)
+                for _ in range(10):
+                    origin, target = rand.choice(list(grid)), rand.choice(list(grid))
+                    try:
+                        path = grid.path(*origin, *target)
+                    except NoPathFound:
+                        continue
+                    waypoints = grid.smooth_path(path)
+                    self.assertLessEqual(len(waypoints), len(path))
+                    expanded = Pathfinder.expand(grid, waypoints)
+                    self.assertValidPath(grid, expanded, origin, target)
+                    self.assertLessEqual(path_cost(grid, expanded), path_cost(grid, path))
+
+                    start, runs = grid.smooth_path(path, run_length=True)
+                    self.assertEqual(start, origin)
+                    self.assertEqual(Pathfinder.from_run_length(grid, start, runs), expanded)
+
+        SquareGeometry.set_no_diags(False)
+        grid = SquareGrid(10, 10)
+        path = [(0, 0), (1, 0), (2, 0), (3, 1), (4, 2), (5, 2)]
+        self.assertEqual(grid.smooth_path(path), [(0, 0), (5, 2)])
+        self.assertEqual(Pathfinder.run_length(grid, path), ((0, 0), [(4, 2), (7, 2), (4, 1)]))
+
+        # the line is not followed if it costs more
+        grid.set_cost(2, 1, 10)
+        expanded = Pathfinder.expand(grid, grid.smooth_path(path))
+        self.assertNotIn((2, 1), expanded)
+        self.assertEqual(path_cost(grid, expanded), path_cost(grid, path))
+        self.assertRaises(ValueError, Pathfinder.run_length, grid, [(0, 0), (2, 0)])
+
+    def test_stats(self):
+        grid = SquareGrid(30, 30)
+        queries = []
+        stats = SearchStats(callback=queries.append)
+        grid.path(0, 0, 20, 10, stats=stats)
+        self.assertEqual(len(queries), 1)
+        query = queries[0]
+        self.assertEqual(query.queries, 1)
+        self.assertGreater(query.expanded, 0)
+        self.assertGreaterEqual(query.pushed, query.expanded)
+        self.assertGreater(query.peak_heap, 0)
+        self.assertEqual(query.movingcost_calls, 0)
+        self.assertGreaterEqual(query.time, 0)
+
+        # the statistics are aggregated
+        self.assertRaises(NoPathFound, Pathfinder.a_star, WalledSquareGrid(5, 5, walls=[(4, 4)]), \
+                          (0, 0), (4, 4), stats=stats)
+        list(Pathfinder.anytime_search(grid, (0, 0), (20, 10), stats=stats))
+        self.assertEqual(stats.queries, 3)
+        self.assertGreater(queries[1].movingcost_calls, 0)
+        self.assertEqual(stats.expanded, sum(query.expanded for query in queries))
+        self.assertEqual(stats.peak_heap, max(query.peak_heap for query in queries))
+
+        # the engines without counters record the queries and their time
+        for engine in Pathfinder.ENGINES:
+            if engine in Pathfinder.COUNTED_ENGINES:
+                continue
+            timed = SearchStats()
+            self.assertEqual(grid.path(0, 0, 20, 10, engine=engine, stats=timed)[-1], (20, 10))
+            self.assertEqual(timed.queries, 1)
+            self.assertGreaterEqual(timed.time, 0)
+            self.assertEqual(timed.expanded, 0)
+
+        output = io.StringIO()
+        stats.dump(output)
+        self.assertIn("expanded: {}".format(stats.expanded), output.getvalue())
+        self.assertEqual(set(stats.as_dict()), set(SearchStats.FIELDS))
+        stats.reset()
+        self.assertEqual(stats.queries, 0)
+
+    def test_layered(self):
+        SquareGeometry.set_no_diags(False)
+        dungeon = LayeredGrid([SquareGrid(20, 20), SquareGrid(20, 20), SquareGrid(20, 20)])
+        dungeon.connect(5, 5, 0, 5, 5, 1, cost=3)
+        dungeon.connect(15, 15, 1, 15, 15, 2)
+        self.assertEqual(dungeon.connectors(5, 5, 1), [(5, 5, 0, 3)])
+
+        path = dungeon.path(0, 0, 0, 19, 19, 2)
+        self.assertEqual(path[0], (0, 0, 0))
+        self.assertEqual(path[-1], (19, 19, 2))
+        self.assertIn((5, 5, 0), path)
+        self.assertIn((15, 15, 2), path)
+        self.assertEqual(len(path), 22)
+
+        # a level change is an edge of its own cost
+        dungeon.connect(0, 0, 0, 19, 19, 1, cost=20)
+        self.assertEqual(dungeon.path(0, 0, 0, 19, 19, 1), [(0, 0, 0), (19, 19, 1)])
+        dungeon.connect(0, 0, 0, 19, 19, 1, cost=40)
+        self.assertNotEqual(dungeon.path(0, 0, 0, 19, 19, 1), [(0, 0, 0), (19, 19, 1)])
+
+        # one way connectors
+        dungeon.disconnect(5, 5, 0, 5, 5, 1)
+        dungeon.disconnect(0, 0, 0, 19, 19, 1)
+        dungeon.connect(5, 5, 1, 5, 5, 0, both_ways=False)
+        self.assertEqual(dungeon.path(6, 6, 1, 4, 4, 0), [(6, 6, 1), (5, 5, 1), (5, 5, 0), (4, 4, 0)])
+        self.assertRaises(NoPathFound, dungeon.path, 4, 4, 0, 6, 6, 1)
+
+        # the moving costs of the levels are used
+        for y in range(20):
+            dungeon[0].set_cost(2, y, -1)
+        self.assertRaises(NoPathFound, dungeon.path, 0, 0, 0, 4, 4, 0)
+
+        self.assertRaises(ValueError, dungeon.path, 0, 0, 3, 1, 1, 0)
+        self.assertRaises(ValueError, dungeon.connect, 0, 0, 0, 20, 0, 1)
+        self.assertRaises(ValueError, LayeredGrid, [SquareGrid(5, 5), FHexGrid(5, 5)])
+        self.assertRaises(ValueError, LayeredGrid, [])
+
+    def test_paths(self):
+        SquareGeometry.set_no_diags(True)
+        grid = SquareGrid(40, 40)
+        random_walls(grid, 0.25, 9)
+        grid.set_cost(0, 0, 1)
+        cells = [cell for cell in grid if grid.passable(*cell)]
+        rnd = random.Random(4)
+        pairs = [((0, 0), rnd.choice(cells)) for _ in range(20)]
+        pairs += [(rnd.choice(cells), rnd.choice(cells)) for _ in range(20)]
+        pairs += [((0, 0), (50, 50)), ((0, 0), (1, 1))]
+
+        for workers in (None, 2):
+            results = grid.paths(pairs, workers=workers)
+            self.assertEqual(len(results), len(pairs))
+            for (origin, target), result in zip(pairs, results):
+                if target == (50, 50):
+                    self.assertIsInstance(result, ValueError)
+                elif isinstance(result, NoPathFound):
+                    self.assertIsNone(cheapest_cost(grid, origin, target))
+                else:
+                    self.assertValidPath(grid, result, origin, target)
+                    self.assertEqual(path_cost(grid, result), cheapest_cost(grid, origin, target))
+
+        for engine in ("nearest", "bogus"):
+            self.assertRaises(ValueError, grid.paths, pairs, engine=engine)
+
+        # the other engines are not replaced by the shared search
+        for engine in ("flat", "jps"):
+            results = grid.paths(pairs[:20], engine=engine)
+            for (origin, target), result in zip(pairs[:20], results):
+                try:
+                    expected = getattr(Pathfinder, engine)(grid, origin, target)
+                except NoPathFound:
+                    self.assertIsInstance(result, NoPathFound)
+                else:
+                    self.assertEqual(result, expected)
+
+        costs, parents = Pathfinder.dijkstra(grid, (0, 0), max_cost=5)
+        self.assertTrue(all(cost <= 5 for cost in costs.values()))
+        self.assertEqual(Pathfinder.path_to(parents, (0, 0)), [(0, 0)])
+
+if __name__ == "__main__":
+    unittest.main()